@@ -0,0 +1,107 @@
+"""Cold start benchmark for the ocsharetools command
+
+Measures, in fresh interpreters, the time to import ocsharetools_cli and
+the wall time of a whole `ocsharetools getshares` run against a local
+mock server, and prints the results as JSON:
+
+    python benchmarks/cold_start.py --runs 20 > cold_start.json
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_server import MockServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_CODE = (
+    'import time; start = time.perf_counter(); import ocsharetools_cli; '
+    'print(time.perf_counter() - start)'
+)
+
+
+def summary(samples):
+    return {
+        'median': statistics.median(samples),
+        'min': min(samples),
+        'max': max(samples),
+        'runs': len(samples)
+    }
+
+
+def python(args, python_path=sys.executable):
+    """Run python with the repository importable, returns its stdout"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run(
+        [python_path] + args,
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True
+    ).stdout
+
+
+def timed(args, python_path=sys.executable):
+    start = time.perf_counter()
+    python(args, python_path)
+    return time.perf_counter() - start
+
+
+def cold_start(runs=10, python_path=sys.executable):
+    """Return the cold start results as a dict"""
+    server = MockServer(shares=10).start()
+    cli = [
+        '-c', 'import ocsharetools_cli; ocsharetools_cli.run()',
+        '--username', 'user', '--password', 'secret', '--url', server.url,
+        '--no-daemon'
+    ]
+    try:
+        results = {
+            'interpreter': summary([
+                timed(['-c', 'pass'], python_path) for i in range(runs)
+            ]),
+            'import_ocsharetools_cli': summary([
+                float(python(['-c', IMPORT_CODE], python_path))
+                for i in range(runs)
+            ]),
+            'getshares': summary([
+                timed(cli + ['getshares'], python_path) for i in range(runs)
+            ]),
+            'delete': summary([
+                timed(cli + ['delete', '1'], python_path)
+                for i in range(runs)
+            ])
+        }
+    finally:
+        server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--python', default=sys.executable,
+                        help='interpreter to benchmark')
+    args = parser.parse_args()
+    print(json.dumps({
+        'benchmark': 'cold_start',
+        'time': time.time(),
+        'python': python(
+            ['-c', 'import platform; print(platform.python_version())'],
+            args.python
+        ).strip(),
+        'platform': platform.platform(),
+        'seconds': cold_start(args.runs, args.python)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
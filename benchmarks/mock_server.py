@@ -0,0 +1,338 @@
+"""A local stand-in for the ownCloud OCS share API, for benchmarks"""
+
+import json
+import time
+import random
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl, quote, unquote
+
+API_PATH = '/ocs/v1.php/apps/files_sharing/api/v1'
+WEBDAV_PATH = '/remote.php/webdav'
+
+
+def make_share(share_id):
+    """Return a share dict shaped like the server's"""
+    path = '/Projects/%d/file%d.odt' % (share_id % 100, share_id)
+    share_type = (0, 1, 3)[share_id % 3]
+    return {
+        'id': share_id,
+        'share_type': share_type,
+        'uid_owner': 'admin',
+        'displayname_owner': 'admin',
+        'permissions': 1 if share_type == 3 else 31,
+        'stime': 1420070400 + share_id,
+        'parent': None,
+        'expiration': None,
+        'token': 'token%d' % share_id if share_type == 3 else None,
+        'uid_file_owner': 'admin',
+        'displayname_file_owner': 'admin',
+        'path': path,
+        'item_type': 'file',
+        'mimetype': 'application/vnd.oasis.opendocument.text',
+        'storage_id': 'home::admin',
+        'storage': 1,
+        'item_source': share_id,
+        'file_source': share_id,
+        'file_parent': 2,
+        'file_target': path,
+        'share_with': None if share_type == 3 else 'user%d' % share_id,
+        'share_with_displayname': None,
+        'mail_send': 0
+    }
+
+
+class MockServer:
+    """Serves the OCS share API from memory on localhost
+
+    Shares can be listed, fetched, created, updated and deleted, changes
+    are kept until the server is stopped.
+
+    Keyword arguments:
+        shares -- Number of shares to start with
+        latency -- Seconds to wait before answering each request
+        error_rate -- Fraction of requests answered with error_status
+                      instead, picked at random
+        error_status -- HTTP status of injected errors (default 503)
+        retry_after -- Retry-After header sent with injected errors
+        seed -- Seed for picking the requests that fail
+        empty_folders -- Unshared subfolders under each folder holding
+                         shares, with as many of their own, two levels
+                         deep, like the bulk of a real account
+        infinite_depth -- Whether Depth: infinity PROPFINDs are answered
+                          in full, otherwise with the direct entries only
+    """
+
+    def __init__(self, shares=100, latency=0, error_rate=0, error_status=503,
+                 retry_after=None, seed=0, empty_folders=0,
+                 infinite_depth=True):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.empty_folders = empty_folders
+        self.infinite_depth = infinite_depth
+        self.requests = 0
+        self.errors = 0
+        self.propfinds = 0
+        self.shares = OrderedDict(
+            (i, make_share(i)) for i in range(1, shares + 1)
+        )
+        self._next_id = shares + 1
+        self._listing = None
+        self._tree = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d' % self._server.server_port
+
+    def listing(self):
+        """Return the body of a listing of every share"""
+        with self._lock:
+            if self._listing is None:
+                self._listing = self.feed(list(self.shares.values()))
+            return self._listing
+
+    @staticmethod
+    def feed(data, statuscode=100):
+        return json.dumps({'ocs': {
+            'meta': {
+                'status': 'ok' if statuscode == 100 else 'failure',
+                'statuscode': statuscode,
+                'message': None
+            },
+            'data': data
+        }}).encode('utf-8')
+
+    def fail(self):
+        """Return whether to answer the next request with an error"""
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+    def _changed(self):
+        """Drop what was derived from the shares, call holding _lock"""
+        self._listing = None
+        self._tree = None
+
+    def tree(self):
+        """Return the folders holding shared paths
+
+        As {folder: {entry: [is_folder, set of share types]}}, the
+        folders and entries on the way to a shared path, and the unshared
+        empty_folders.
+        """
+        with self._lock:
+            if self._tree is None:
+                tree = {'/': {}}
+                for share in self.shares.values():
+                    parts = share['path'].strip('/').split('/')
+                    for depth in range(len(parts)):
+                        parent = '/' + '/'.join(parts[:depth])
+                        entry = '/' + '/'.join(parts[:depth + 1])
+                        info = tree.setdefault(parent, {}).setdefault(
+                            entry, [False, set()]
+                        )
+                        if depth < len(parts) - 1:
+                            info[0] = True
+                        else:
+                            info[0] = info[0] or share['item_type'] == 'folder'
+                            info[1].add(share['share_type'])
+                for folder in list(tree) if self.empty_folders else ():
+                    self._add_empty(tree, folder, 2)
+                self._tree = tree
+            return self._tree
+
+    def _add_empty(self, tree, folder, depth):
+        """Add empty_folders unshared folders under folder, depth deep"""
+        for i in range(self.empty_folders):
+            entry = folder.rstrip('/') + '/Archive%d' % i
+            tree[folder][entry] = [True, set()]
+            tree[entry] = {}
+            if depth > 1:
+                self._add_empty(tree, entry, depth - 1)
+
+    def propfind(self, path, depth='1'):
+        """Answer a Depth: 1 or infinity PROPFIND of a folder"""
+        folder = '/' + unquote(path[len(WEBDAV_PATH):]).strip('/')
+        tree = self.tree()
+        if folder not in tree:
+            return 404, b''
+        responses = [(folder, True, ())]
+        infinite = depth == 'infinity' and self.infinite_depth
+
+        def add(folder):
+            for entry, info in sorted(tree[folder].items()):
+                responses.append((entry, info[0], sorted(info[1])))
+                if infinite and info[0]:
+                    add(entry)
+        add(folder)
+        body = ['<?xml version="1.0"?>'
+                '<d:multistatus xmlns:d="DAV:" '
+                'xmlns:oc="http://owncloud.org/ns">']
+        for entry, is_folder, share_types in responses:
+            body.append(
+                '<d:response><d:href>%s%s%s</d:href><d:propstat><d:prop>'
+                '<d:resourcetype>%s</d:resourcetype>'
+                '<oc:share-types>%s</oc:share-types>'
+                '</d:prop><d:status>HTTP/1.1 200 OK</d:status>'
+                '</d:propstat></d:response>' % (
+                    WEBDAV_PATH,
+                    quote(entry.rstrip('/')),
+                    '/' if is_folder else '',
+                    '<d:collection/>' if is_folder else '',
+                    ''.join(
+                        '<oc:share-type>%d</oc:share-type>' % share_type
+                        for share_type in share_types
+                    )
+                )
+            )
+        body.append('</d:multistatus>')
+        return 207, ''.join(body).encode('utf-8')
+
+    def respond(self, method, path, query, form, headers=None):
+        """Return (http status, body, headers) for a request
+
+        Every endpoint is answered after the configured latency and may
+        be failed with error_status instead.
+        """
+        if method == 'PROPFIND':
+            with self._lock:
+                self.propfinds += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self.fail():
+            headers = {}
+            if self.retry_after is not None:
+                headers['Retry-After'] = str(self.retry_after)
+            return self.error_status, b'error', headers
+        status, body = self.route(method, path, query, form, headers or {})
+        return status, body, {}
+
+    def route(self, method, path, query, form, headers):
+        """Return (http status, body) for a request to an endpoint"""
+        if method == 'PROPFIND' and path.startswith(WEBDAV_PATH):
+            return self.propfind(path, headers.get('Depth', '1'))
+        if path == API_PATH + '/shares':
+            if method == 'GET':
+                return 200, self.get_shares(query)
+            if method == 'POST':
+                return 200, self.create_share(form)
+        elif path.startswith(API_PATH + '/shares/'):
+            try:
+                share_id = int(path[len(API_PATH + '/shares/'):])
+            except ValueError:
+                return 404, self.feed([], 404)
+            with self._lock:
+                share = self.shares.get(share_id)
+                if share is None:
+                    return 200, self.feed([], 404)
+                if method == 'GET':
+                    return 200, self.feed([share])
+                self._changed()
+                if method == 'DELETE':
+                    del self.shares[share_id]
+                    return 200, self.feed([])
+                if method == 'PUT':
+                    self.update_share(share, form)
+                    return 200, self.feed([])
+        return 405, self.feed([], 405)
+
+    def get_shares(self, query):
+        path = query.get('path')
+        if path is None:
+            return self.listing()
+        path = '/' + path.strip('/')
+        with self._lock:
+            if query.get('subfiles') == 'True':
+                shares = [
+                    share for share in self.shares.values()
+                    if (share['path'].rsplit('/', 1)[0] or '/') == path
+                ]
+            else:
+                shares = [
+                    share for share in self.shares.values()
+                    if share['path'] == path
+                ]
+        return self.feed(shares)
+
+    def create_share(self, form):
+        with self._lock:
+            share = make_share(self._next_id)
+            self._next_id += 1
+            share_type = int(form.get('shareType', 3))
+            share.update({
+                'path': form.get('path', share['path']),
+                'file_target': form.get('path', share['path']),
+                'share_type': share_type,
+                'share_with': form.get('shareWith'),
+                'token': 'token%d' % share['id'] if share_type == 3 else None
+            })
+            if 'permissions' in form:
+                share['permissions'] = int(form['permissions'])
+            self.shares[share['id']] = share
+            self._changed()
+        return self.feed(share)
+
+    @staticmethod
+    def update_share(share, form):
+        if 'permissions' in form:
+            share['permissions'] = int(form['permissions'])
+        if 'expireDate' in form:
+            # Sent as DD-MM-YYYY, returned as YYYY-MM-DD 00:00:00
+            expiration = None
+            if form['expireDate']:
+                day, month, year = form['expireDate'].split('-')
+                expiration = '%s-%s-%s 00:00:00' % (year, month, day)
+            share['expiration'] = expiration
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out as separate writes, without this
+            # delayed ACKs add 40ms to every keep-alive round trip
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def handle_request(self):
+                server.requests += 1
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                form = dict(parse_qsl(self.rfile.read(length).decode()))
+                status, body, headers = server.respond(
+                    self.command,
+                    url.path,
+                    dict(parse_qsl(url.query)),
+                    form,
+                    self.headers
+                )
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_DELETE = handle_request
+            do_PROPFIND = handle_request
+
+        return Handler
+
+    def start(self):
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,304 @@
+"""Benchmark suite for ocsharetools
+
+Runs the client against a local mock of the OCS share API and prints the
+results as JSON, to be kept and compared between versions:
+
+    python benchmarks/suite.py > before.json
+    python benchmarks/suite.py --compare before.json > after.json
+
+Measures listing parse throughput, create/update/delete round trips (one
+at a time and in bulk), local to cloud path mapping and CLI cold start.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+from mock_server import MockServer
+from cold_start import summary, cold_start
+import ocsharetools
+
+
+def timed(function, runs):
+    """Call function runs times, returns the seconds each call took"""
+    samples = []
+    for i in range(runs):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def rate(samples, count):
+    """Add the median items per second to a summary of samples"""
+    result = summary(samples)
+    result['per_second'] = count / result['median']
+    return result
+
+
+def listing(sizes, runs, latency=0, error_rate=0, empty_folders=3):
+    """Time fetching and parsing listings of each size
+
+    Listings are fetched whole, streamed, and a folder at a time after a
+    WebDAV walk, from a server answering with the given latency and
+    error_rate. Errors are injected as 429s, which are retried. The
+    account has empty_folders unshared folders per shared one, the
+    PROPFINDs each partitioned listing took are reported.
+    """
+    results = {}
+    for size in sizes:
+        server = MockServer(
+            shares=size,
+            latency=latency,
+            error_rate=error_rate,
+            error_status=429,
+            retry_after=0,
+            empty_folders=empty_folders
+        ).start()
+        body = server.listing()
+        controller = None
+        if error_rate:
+            controller = ocsharetools.ConcurrencyController(maximum=1)
+        try:
+            with ocsharetools.OCShareAPI(
+                    server.url, 'user', 'secret',
+                    controller=controller) as ocs:
+                results[str(size)] = {
+                    'parse': rate(timed(
+                        lambda: ocs._get_shares_result(json.loads(body)),
+                        runs
+                    ), size),
+                    'get_shares': rate(timed(ocs.get_shares, runs), size),
+                    'iter_shares': rate(timed(
+                        lambda: list(ocs.iter_shares()),
+                        runs
+                    ), size),
+                }
+                propfinds = server.propfinds
+                results[str(size)]['get_shares_partitioned'] = rate(timed(
+                    ocs.get_shares_partitioned,
+                    runs
+                ), size)
+                results[str(size)]['propfinds_per_partitioned'] = (
+                    (server.propfinds - propfinds) / runs
+                )
+                results[str(size)]['injected_errors'] = server.errors
+        finally:
+            server.stop()
+    return results
+
+
+def round_trips(count, latency=0, error_rate=0):
+    """Time creating, updating and deleting count shares
+
+    Each operation is timed one call at a time, then in bulk through
+    create_shares/update_shares/delete_shares. With an error_rate the
+    single calls go through a ConcurrencyController too, so failures are
+    retried. Errors are injected as 429s, which creates are retried on.
+    """
+    server = MockServer(
+        shares=0,
+        latency=latency,
+        error_rate=error_rate,
+        error_status=429,
+        retry_after=0
+    ).start()
+    controller = None
+    if error_rate:
+        controller = ocsharetools.ConcurrencyController(maximum=1)
+    ocs = ocsharetools.OCShareAPI(
+        server.url,
+        'user',
+        'secret',
+        controller=controller
+    )
+    specs = [
+        {'path': '/Bench/file%d.odt' % i, 'share_type': 3}
+        for i in range(count)
+    ]
+    try:
+        ocs.get_shares()  # Open the connection
+        created = []
+        results = {'create': summary(timed(
+            lambda: created.append(ocs.create_share(**specs[len(created)])),
+            count
+        ))}
+        ids = [share.id for share in created]
+        updates = iter(ids)
+        results['update'] = summary(timed(
+            lambda: ocs.update_share_by_id(next(updates), permissions=1),
+            count
+        ))
+        deletes = iter(ids)
+        results['delete'] = summary(timed(
+            lambda: ocs.delete_share_by_id(next(deletes)),
+            count
+        ))
+
+        def bulk_controller():
+            return ocsharetools.ConcurrencyController(maximum=ocs.pool_size)
+
+        bulk = {}
+        start = time.perf_counter()
+        created = ocs.create_shares(specs, controller=bulk_controller())
+        bulk['create'] = time.perf_counter() - start
+        ids = [
+            share.id for share in created
+            if isinstance(share, ocsharetools.OCShare)
+        ]
+        start = time.perf_counter()
+        ocs.update_shares(
+            [{'share_id': share_id, 'permissions': 1} for share_id in ids],
+            bulk_controller()
+        )
+        bulk['update'] = time.perf_counter() - start
+        start = time.perf_counter()
+        ocs.delete_shares(ids, bulk_controller())
+        bulk['delete'] = time.perf_counter() - start
+        for name, seconds in bulk.items():
+            results['bulk_' + name] = {
+                'seconds': seconds,
+                'per_second': count / seconds
+            }
+        results['failed'] = count - len(ids)
+        results['injected_errors'] = server.errors
+    finally:
+        ocs.close()
+        server.stop()
+    return results
+
+
+def path_mapping(folders, lookups):
+    """Time mapping local paths to the cloud with folders sync folders"""
+    directory = tempfile.mkdtemp()
+    try:
+        for i in range(folders):
+            with open(os.path.join(directory, 'folder%d' % i), 'w') as f:
+                f.write(
+                    '[ownCloud]\nlocalPath=/home/user/sync%d/\n'
+                    'targetPath=/Folder%d\n' % (i, i)
+                )
+        folder_map = ocsharetools.SyncFolderMap(directory, check_interval=60)
+        paths = [
+            '/home/user/sync%d/Projects/%d/file%d.odt' % (i % folders, i, i)
+            for i in range(lookups)
+        ]
+        start = time.perf_counter()
+        folder_map.reload(force=True)
+        load = time.perf_counter() - start
+
+        def map_all():
+            for path in paths:
+                folder_map.local_to_cloud(path)
+        return {
+            'load_seconds': load,
+            'local_to_cloud': rate(timed(map_all, 5), lookups)
+        }
+    finally:
+        shutil.rmtree(directory)
+
+
+def flatten(results, prefix=''):
+    """Return the numbers in nested results keyed by dotted path"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(old, new, out=sys.stderr):
+    """Print how each median and rate moved between two result sets"""
+    old, new = flatten(old), flatten(new)
+    for key in sorted(new):
+        if key not in old or not old[key]:
+            continue
+        if not key.endswith(('median', 'seconds', 'per_second')):
+            continue
+        change = (new[key] - old[key]) / old[key] * 100
+        print('%-50s %12.6g %12.6g %+7.1f%%' % (
+            key, old[key], new[key], change
+        ), file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000],
+                        help='listing sizes to parse (default %(default)s)')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='times to repeat each measurement')
+    parser.add_argument('--round-trips', type=int, default=200,
+                        help='shares to create, update and delete')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds the mock server waits per request')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of requests the mock server fails')
+    parser.add_argument('--empty-folders', type=int, default=3,
+                        help='unshared folders per shared one, two levels '
+                             'deep, in the listing benchmarks')
+    parser.add_argument('--folders', type=int, default=50,
+                        help='sync folders to map paths through')
+    parser.add_argument('--lookups', type=int, default=100000,
+                        help='paths to map')
+    parser.add_argument('--skip', nargs='+', default=[],
+                        choices=['listing', 'round_trips', 'path_mapping',
+                                 'cold_start'],
+                        help='benchmarks not to run')
+    parser.add_argument('--compare', type=argparse.FileType('r'),
+                        help='earlier results to print changes against, '
+                             'on stderr')
+    args = parser.parse_args()
+
+    results = {}
+    if 'listing' not in args.skip:
+        results['listing'] = listing(
+            args.sizes,
+            args.runs,
+            args.latency,
+            args.error_rate,
+            args.empty_folders
+        )
+    if 'round_trips' not in args.skip:
+        results['round_trips'] = round_trips(
+            args.round_trips,
+            args.latency,
+            args.error_rate
+        )
+    if 'path_mapping' not in args.skip:
+        results['path_mapping'] = path_mapping(args.folders, args.lookups)
+    if 'cold_start' not in args.skip:
+        results['cold_start'] = cold_start(args.runs)
+    print(json.dumps({
+        'benchmark': 'suite',
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': {
+            'sizes': args.sizes,
+            'runs': args.runs,
+            'round_trips': args.round_trips,
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'empty_folders': args.empty_folders,
+            'folders': args.folders,
+            'lookups': args.lookups
+        },
+        'results': results
+    }, indent=2))
+    if args.compare:
+        compare(json.load(args.compare)['results'], results)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,20 @@
 #!/usr/bin/python3
 
-import requests
+# Modules only some commands need (requests, configparser, calendar and
+# concurrent.futures) are imported where they are used, to keep start up
+# fast for the command line tool.
 import os
-import configparser as ConfigParser
+import array
+import json
+import codecs
+import contextlib
+import threading
+import time
+import random
+import bisect
+import weakref
+from collections import OrderedDict, Counter
+from itertools import chain, compress
 
 DEBUG = False
 if DEBUG:
@@ -19,19 +31,47 @@ PERMISSION_CREATE = 4
 PERMISSION_DELETE = 8
 PERMISSION_SHARE = 16
 
+# Fields the tools rely on, ownCloud < 9 only returns id, url and token
+# when a share is created, newer versions return the whole share.
+SHARE_FIELDS = frozenset([
+    'id', 'share_type', 'share_with', 'path', 'permissions', 'token',
+    'expiration', 'stime', 'item_source'
+])
+
 API_PATH = '/ocs/v1.php/apps/files_sharing/api/v1'
 SHARE_PATH = '/public.php?service=files&t='
+WEBDAV_PATH = '/remote.php/webdav'
+OWNCLOUD_NS = 'http://owncloud.org/ns'
+PROPFIND_BODY = (
+    '<?xml version="1.0"?>'
+    '<d:propfind xmlns:d="DAV:" xmlns:oc="%s">'
+    '<d:prop><d:resourcetype/><oc:share-types/></d:prop>'
+    '</d:propfind>' % OWNCLOUD_NS
+)
 
 from sys import platform as _platform
-if _platform == 'linux' or _platform == 'linux2':
-    CONFIG_PATH = os.path.expanduser('~/.local/share/data/ownCloud')
-    FOLDER_CHAR = '/'
-elif _platform == 'darwin':
-    CONFIG_PATH = os.path.expanduser('~/Library/Application Support/ownCloud')
-    FOLDER_CHAR = '/'
-elif _platform == 'win32':
-    CONFIG_PATH = os.environ['APPDATA']+'\ownCloud\owncloud.cfg'
+if _platform == 'win32':
     FOLDER_CHAR = '\\'
+else:
+    FOLDER_CHAR = '/'
+
+
+def get_config_path():
+    """Return the ownCloud client's configuration directory"""
+    if _platform == 'darwin':
+        return os.path.expanduser('~/Library/Application Support/ownCloud')
+    elif _platform == 'win32':
+        return os.environ['APPDATA']+'\ownCloud\owncloud.cfg'
+    return os.path.expanduser('~/.local/share/data/ownCloud')
+
+
+def __getattr__(name):
+    # CONFIG_PATH is looked up on first use rather than at import
+    if name == 'CONFIG_PATH':
+        return get_config_path()
+    raise AttributeError(
+        "module '%s' has no attribute '%s'" % (__name__, name)
+    )
 
 
 def check_status(jsonfeed):
@@ -40,38 +80,178 @@ def check_status(jsonfeed):
 
 
 def check_request(request):
+    """Raise requests.exceptions.HTTPError for a non 200 response
+
+    request only needs status_code, reason and raise_for_status(), so any
+    response object exposing those can be checked.
+    """
     if request.status_code != 200:
         request.raise_for_status()
+        import requests
         raise requests.exceptions.HTTPError(
             '%s Client Error: %s' % (request.status_code, request.reason))
 
 
-def full_path_to_cloud(fullPath):
-    paths = []
-    for f in os.listdir(CONFIG_PATH+'/folders'):
-        config = ConfigParser.ConfigParser()
-        config.read('%s/%s' % (CONFIG_PATH+'/folders', f))
-        paths.append(config['ownCloud']['localPath'])
+class SyncFolderMap:
+    """Maps paths between the local disk and the cloud
 
-    for path in paths:
-        if fullPath[:len(path)] == path:
-            return fullPath[len(path)-1:]
-    return None
+    Built from the ownCloud client's sync folder configs, and rebuilt only
+    when those files change (checked at most every check_interval
+    seconds). Lookups are a longest-prefix match through a trie of path
+    components, so nested sync folders map to the most specific one.
 
+    Keyword arguments:
+        folders_path -- Directory holding the sync folder configs
+                        (default CONFIG_PATH/folders)
+        check_interval -- Seconds between checks for changed configs
+    """
 
-def get_instant_upload_path():
-    for f in os.listdir(CONFIG_PATH+'/folders'):
-        config = ConfigParser.ConfigParser()
-        config.read('%s/%s' % (CONFIG_PATH+'/folders', f))
-        if config['ownCloud']['targetPath'] == '/':
-            return (
-                config['ownCloud']['localPath'] +
-                FOLDER_CHAR +
-                'InstantUpload' +
-                FOLDER_CHAR
+    def __init__(self, folders_path=None, check_interval=1.0):
+        if folders_path is None:
+            folders_path = get_config_path()+'/folders'
+        self.folders_path = folders_path
+        self.check_interval = check_interval
+        self._signature = None
+        self._checked = None
+        # The folders and the local and cloud tries, replaced together so
+        # lookups from other threads never see a map being built
+        self._map = ((), [None, {}], [None, {}])
+        self._lock = threading.Lock()
+
+    @property
+    def folders(self):
+        """The (local path, cloud path) of every sync folder"""
+        return list(self._map[0])
+
+    def _scan(self):
+        """Return the modification times of the folder configs"""
+        try:
+            entries = list(os.scandir(self.folders_path))
+        except OSError:
+            return None
+        signature = []
+        for entry in entries:
+            try:
+                signature.append((entry.path, entry.stat().st_mtime_ns))
+            except FileNotFoundError:
+                # Removed since the directory was listed
+                continue
+        return tuple(sorted(signature))
+
+    def _build(self, signature):
+        import configparser
+        folders = []
+        local_trie = [None, {}]
+        cloud_trie = [None, {}]
+        for filename, mtime in signature or ():
+            config = configparser.ConfigParser()
+            config.read(filename)
+            if not config.has_section('ownCloud'):
+                continue
+            folder = (
+                config['ownCloud']['localPath'],
+                config['ownCloud'].get('targetPath', '/')
             )
+            folders.append(folder)
+            self._insert(local_trie, self._local_parts(folder[0]), folder)
+            self._insert(cloud_trie, self._cloud_parts(folder[1]), folder)
+        self._map = (tuple(folders), local_trie, cloud_trie)
+
+    def reload(self, force=False):
+        """Rebuild the map if the folder configs have changed"""
+        now = time.monotonic()
+        with self._lock:
+            if (not force and self._checked is not None and
+                    now - self._checked < self.check_interval):
+                return
+            self._checked = now
+            signature = self._scan()
+            if force or signature != self._signature:
+                self._build(signature)
+                self._signature = signature
+
+    @staticmethod
+    def _local_parts(path):
+        return [part for part in path.split(FOLDER_CHAR) if part]
+
+    @staticmethod
+    def _cloud_parts(path):
+        return [part for part in path.split('/') if part]
+
+    @staticmethod
+    def _insert(trie, parts, folder):
+        node = trie
+        for part in parts:
+            node = node[1].setdefault(part, [None, {}])
+        node[0] = folder
+
+    @staticmethod
+    def _lookup(trie, parts):
+        """Return the deepest folder on parts, and the parts left over"""
+        node = trie
+        folder, depth = node[0], 0
+        for i, part in enumerate(parts):
+            node = node[1].get(part)
+            if node is None:
+                break
+            if node[0] is not None:
+                folder, depth = node[0], i + 1
+        return folder, parts[depth:]
+
+    def local_to_cloud(self, path):
+        """Return the cloud path of a local path, or None"""
+        self.reload()
+        folder, rest = self._lookup(self._map[1], self._local_parts(path))
+        if folder is None:
+            return None
+        return '/' + '/'.join(self._cloud_parts(folder[1]) + rest)
+
+    def cloud_to_local(self, path):
+        """Return the local path of a cloud path, or None"""
+        self.reload()
+        folder, rest = self._lookup(self._map[2], self._cloud_parts(path))
+        if folder is None:
+            return None
+        return FOLDER_CHAR.join([folder[0].rstrip(FOLDER_CHAR)] + rest)
+
+    def root_folder(self):
+        """Return the local path synced to the cloud root, or None"""
+        self.reload()
+        folder = self._map[2][0]
+        if folder is None:
+            return None
+        return folder[0]
+
+
+_sync_folder_map = None
+
+
+def sync_folder_map():
+    """Return the shared SyncFolderMap for CONFIG_PATH"""
+    global _sync_folder_map
+    if _sync_folder_map is None:
+        _sync_folder_map = SyncFolderMap()
+    return _sync_folder_map
+
+
+def full_path_to_cloud(fullPath):
+    return sync_folder_map().local_to_cloud(fullPath)
+
 
-    return None
+def cloud_to_full_path(cloudPath):
+    return sync_folder_map().cloud_to_local(cloudPath)
+
+
+def get_instant_upload_path():
+    path = sync_folder_map().root_folder()
+    if path is None:
+        return None
+    return (
+        path.rstrip(FOLDER_CHAR) +
+        FOLDER_CHAR +
+        'InstantUpload' +
+        FOLDER_CHAR
+    )
 
 
 class OCShareException(Exception):
@@ -84,12 +264,1957 @@ class OCShareException(Exception):
         return '%d %s' % (self.status_code, self.message)
 
 
-class OCShareAPI:
-    def __init__(self, url, username, password, disable_ssl_verification=False):
+def normalize_path(path):
+    """Normalize a cloud path to the form the server reports, eg /a/b"""
+    return '/' + path.strip('/')
+
+
+class ShareCache:
+    """An in-memory TTL/LRU cache of share listings and shares
+
+    Pass one to OCShareAPI to cache get_shares and get_share_by_id. Entries
+    touched by create, update and delete calls made through that client
+    are invalidated (or updated in place, for deletes) automatically;
+    changes made by anyone else are only picked up once the ttl runs out.
+
+    Keyword arguments:
+        ttl -- Seconds an entry stays valid (default 60)
+        maxsize -- Maximum number of cached entries (default 256)
+    """
+
+    def __init__(self, ttl=60, maxsize=256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def stats(self):
+        """Return the hit, miss and eviction counters and current size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries)
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _listing_key(self, path, reshares, subfiles):
+        if path is not None:
+            path = normalize_path(path)
+        return ('shares', path, bool(reshares), bool(subfiles))
+
+    def get_shares(self, path=None, reshares=None, subfiles=None):
+        """Return a cached listing, or None"""
+        shares = self._get(self._listing_key(path, reshares, subfiles))
+        if shares is not None:
+            return list(shares)
+        return None
+
+    def put_shares(self, shares, path=None, reshares=None, subfiles=None):
+        self._put(
+            self._listing_key(path, reshares, subfiles),
+            tuple(shares)
+        )
+
+    def get_share(self, share_id):
+        """Return a cached share, or None"""
+        return self._get(('share', share_id))
+
+    def put_share(self, share):
+        self._put(('share', share.id), share)
+
+    def share_created(self, share):
+        """Drop the listings a new share would appear in"""
+        path = normalize_path(share.path)
+        parent = path.rsplit('/', 1)[0] or '/'
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] != 'shares':
+                    continue
+                listing_path, subfiles = key[1], key[3]
+                if (listing_path is None or listing_path == path or
+                        (subfiles and listing_path == parent)):
+                    del self._entries[key]
+        self.put_share(share)
+
+    def share_updated(self, share_id, changes):
+        """Drop the share and every listing holding it"""
+        with self._lock:
+            self._entries.pop(('share', share_id), None)
+            for key, (expires, value) in list(self._entries.items()):
+                if (key[0] == 'shares' and
+                        any(share.id == share_id for share in value)):
+                    del self._entries[key]
+
+    def share_deleted(self, share_id):
+        """Drop the share and remove it from every listing holding it"""
+        with self._lock:
+            self._entries.pop(('share', share_id), None)
+            for key, (expires, value) in list(self._entries.items()):
+                if key[0] != 'shares':
+                    continue
+                shares = tuple(
+                    share for share in value if share.id != share_id
+                )
+                if len(shares) != len(value):
+                    self._entries[key] = (expires, shares)
+
+
+class OCSDataParser:
+    """Incremental parser for the data array of an OCS json response
+
+    Feed it the response body in chunks of bytes as they arrive, each
+    feed() returns the items of ocs.data that have been completed so far.
+    The ocs.meta status is checked as soon as it has been read, raising
+    OCShareException on failure, and no items are returned before that.
+    Call close() once the body is complete.
+    """
+
+    def __init__(self):
+        self.meta = None
+        self._items = []
+        self._pending = []
+        self._buf = ''
+        self._pos = 0
+        self._done = False
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._parser = self._parse()
+        next(self._parser)
+
+    def _send(self, text):
+        if self._done:
+            return
+        try:
+            self._parser.send(text)
+        except StopIteration:
+            self._done = True
+
+    def feed(self, data):
+        """Parse a chunk of the body, returns the items completed by it"""
+        self._send(self._decoder.decode(data))
+        items, self._items = self._items, []
+        return items
+
+    def close(self):
+        """Finish parsing, returns any remaining items"""
+        self._send(self._decoder.decode(b'', True))
+        self._send(None)
+        if self.meta is None:
+            raise ValueError('OCS response has no meta')
+        items, self._items = self._items, []
+        return items
+
+    def _more(self):
+        text = yield
+        if text is None:
+            raise ValueError('Truncated OCS response')
+        self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+
+    def _skip_ws(self):
+        while True:
+            while (self._pos < len(self._buf) and
+                    self._buf[self._pos] in ' \t\r\n'):
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            yield from self._more()
+
+    def _expect(self, chars):
+        char = yield from self._skip_ws()
+        if char not in chars:
+            raise ValueError('Unexpected %r in OCS response' % char)
+        self._pos += 1
+        return char
+
+    def _value(self):
+        yield from self._skip_ws()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+            except ValueError:
+                yield from self._more()
+                continue
+            if end == len(self._buf) and self._buf[self._pos] not in '{["':
+                # A number at the end of the buffer may not be complete yet
+                text = yield
+                if text is not None:
+                    self._buf += text
+                    continue
+            self._pos = end
+            return value
+
+    def _members(self, member):
+        yield from self._expect('{')
+        if (yield from self._skip_ws()) == '}':
+            self._pos += 1
+            return
+        while True:
+            key = yield from self._value()
+            yield from self._expect(':')
+            yield from member(key)
+            if (yield from self._expect(',}')) == '}':
+                return
+
+    def _parse(self):
+        yield from self._members(self._top_member)
+
+    def _top_member(self, key):
+        if key == 'ocs':
+            yield from self._members(self._ocs_member)
+        else:
+            yield from self._value()
+
+    def _ocs_member(self, key):
+        if key == 'meta':
+            self.meta = yield from self._value()
+            check_status({'ocs': {'meta': self.meta}})
+            self._items.extend(self._pending)
+            self._pending = []
+        elif key == 'data' and (yield from self._skip_ws()) == '[':
+            self._pos += 1
+            if (yield from self._skip_ws()) == ']':
+                self._pos += 1
+                return
+            while True:
+                item = yield from self._value()
+                if self.meta is None:
+                    self._pending.append(item)
+                else:
+                    self._items.append(item)
+                if (yield from self._expect(',]')) == ']':
+                    return
+        else:
+            yield from self._value()
+
+
+def parse_expiration(expiration):
+    """Parse a share's expiration into a UTC timestamp, or None"""
+    if not expiration:
+        return None
+    import calendar
+    return calendar.timegm(time.strptime(expiration, '%Y-%m-%d %H:%M:%S'))
+
+
+def to_timestamp(value):
+    """Turn a date, datetime or timestamp into a UTC timestamp"""
+    if isinstance(value, (int, float)):
+        return value
+    import calendar
+    return calendar.timegm(value.timetuple())
+
+
+class ShareTable:
+    """Column oriented share listing
+
+    id, share_type, permissions, stime and expiration (as a UTC timestamp,
+    -1 for none) are kept in arrays, path and share_with as indexes into a
+    table of interned strings, and the remaining fields per row. Filters
+    return a new table sharing the same columns, with the selected rows
+    as a mask of one byte per row. Masks are made a column at a time:
+    share_type and permissions by translating the column's bytes, stime,
+    expiration, path and share_with from sorted indexes built on first
+    use, and combined with a bitwise and. OCShare objects are only built
+    when rows are iterated over.
+
+    Keyword arguments:
+        ocshareapi -- The client materialized shares are bound to
+        records -- Iterable of share dicts, eg OCShareAPI.iter_share_data()
+    """
+
+    def __init__(self, ocshareapi, records=()):
+        self.ocshareapi = ocshareapi
+        self.ids = array.array('q')
+        self.share_types = array.array('b')
+        self.permissions = array.array('b')
+        self.stimes = array.array('q')
+        self.expirations = array.array('q')
+        self.paths = array.array('l')
+        self.share_withs = array.array('l')
+        self.strings = []
+        self._string_ids = {}
+        self._extra = []
+        self._extra_keys = {}
+        self._expirations = {}
+        self._mask = None
+        # Shared with every selection, see _index
+        self._indexes = {}
+        for record in records:
+            self.append(record)
+
+    def _intern(self, value):
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def append(self, record):
+        """Add a share dict as a new row"""
+        record = dict(record)
+        self.ids.append(record.pop('id'))
+        self.share_types.append(record.pop('share_type'))
+        self.permissions.append(record.pop('permissions'))
+        self.stimes.append(record.pop('stime', 0) or 0)
+        expiration = record.pop('expiration', None)
+        if expiration not in self._expirations:
+            self._expirations[expiration] = parse_expiration(expiration)
+        timestamp = self._expirations[expiration]
+        self.expirations.append(-1 if timestamp is None else timestamp)
+        self.paths.append(self._intern(record.pop('path')))
+        self.share_withs.append(self._intern(record.pop('share_with', None)))
+        keys = tuple(record)
+        keys = self._extra_keys.setdefault(keys, keys)
+        self._extra.append((keys, tuple(record.values()), expiration))
+        self._indexes.clear()
+
+    def _index(self, name, build):
+        """Return the index called name, calling build() to make it once"""
+        index = self._indexes.get(name)
+        if index is None:
+            index = self._indexes[name] = build()
+        return index
+
+    def _sorted(self, column):
+        """Return a column's values in order, and the row of each"""
+        def build():
+            values = getattr(self, column)
+            order = array.array('l', sorted(
+                range(len(values)),
+                key=values.__getitem__
+            ))
+            return array.array(
+                values.typecode,
+                map(values.__getitem__, order)
+            ), order
+        return self._index(column, build)
+
+    def _mark(self, rows):
+        """Return the mask selecting rows"""
+        mask = bytearray(len(self.ids))
+        for row in rows:
+            mask[row] = 1
+        return bytes(mask)
+
+    def _select(self, mask):
+        """Return a table of the rows selected by both self and mask"""
+        if self._mask is not None:
+            mask = (
+                int.from_bytes(mask, 'little') &
+                int.from_bytes(self._mask, 'little')
+            ).to_bytes(len(mask), 'little')
+        table = ShareTable.__new__(ShareTable)
+        table.__dict__.update(self.__dict__)
+        table._mask = mask
+        return table
+
+    def rows(self):
+        """Return the selected row numbers"""
+        if self._mask is None:
+            return range(len(self.ids))
+        return array.array('l', compress(range(len(self.ids)), self._mask))
+
+    def __len__(self):
+        if self._mask is None:
+            return len(self.ids)
+        return self._mask.count(1)
+
+    def share(self, row):
+        """Build the OCShare for a row number"""
+        keys, values, expiration = self._extra[row]
+        fields = dict(zip(keys, values))
+        fields.update(
+            id=self.ids[row],
+            share_type=self.share_types[row],
+            permissions=self.permissions[row],
+            stime=self.stimes[row],
+            expiration=expiration,
+            path=self.strings[self.paths[row]],
+            share_with=self.strings[self.share_withs[row]]
+        )
+        return OCShare(self.ocshareapi, **fields)
+
+    def __iter__(self):
+        for row in self.rows():
+            yield self.share(row)
+
+    def where(self, column, test):
+        """Select the rows where test(value) is true for a column array
+
+        test is called for every selected row, the other filters are
+        faster where they fit.
+        """
+        return self._select(self._mark(
+            row for row in self.rows() if test(column[row])
+        ))
+
+    def _where_byte(self, column, test):
+        """Select rows of a one byte column where test(value) is true
+
+        test is called once per possible value, to build the table the
+        column's bytes are translated through into the mask.
+        """
+        data = self._index(
+            column + '_bytes',
+            lambda: getattr(self, column).tobytes()
+        )
+        table = bytes(
+            1 if test(value - 256 if value > 127 else value) else 0
+            for value in range(256)
+        )
+        return self._select(data.translate(table))
+
+    def _where_range(self, column, low=None, high=None):
+        """Select rows of a column with low <= value < high"""
+        values, order = self._sorted(column)
+        start = 0 if low is None else bisect.bisect_left(values, low)
+        end = len(values)
+        if high is not None:
+            end = bisect.bisect_left(values, high, start)
+        return self._select(self._mark(order[start:end]))
+
+    def with_permissions(self, permissions):
+        """Select shares that have all the given PERMISSION_* bits"""
+        return self._where_byte(
+            'permissions',
+            lambda value: value & permissions == permissions
+        )
+
+    def without_permissions(self, permissions):
+        """Select shares that have none of the given PERMISSION_* bits"""
+        return self._where_byte(
+            'permissions',
+            lambda value: not value & permissions
+        )
+
+    def of_type(self, *share_types):
+        """Select shares of the given SHARETYPE_* types"""
+        share_types = set(share_types)
+        return self._where_byte('share_types', share_types.__contains__)
+
+    def expiring(self, after=None, before=None):
+        """Select shares expiring in [after, before)
+
+        after and before are dates, datetimes or UTC timestamps, shares
+        without an expiration never match.
+        """
+        low = 0 if after is None else max(0, to_timestamp(after))
+        high = None if before is None else to_timestamp(before)
+        return self._where_range('expirations', low, high)
+
+    def without_expiration(self):
+        return self._where_range('expirations', -1, 0)
+
+    def shared_between(self, after=None, before=None):
+        """Select shares created (stime) in [after, before)"""
+        low = 0 if after is None else to_timestamp(after)
+        high = None if before is None else to_timestamp(before)
+        return self._where_range('stimes', low, high)
+
+    def _sorted_strings(self):
+        """Return the interned strings in order, and the rank of each"""
+        def build():
+            strings = sorted(
+                string for string in self.strings if string is not None
+            )
+            ranks = dict(zip(strings, range(len(strings))))
+            ranks[None] = -1
+            return strings, array.array(
+                'l',
+                map(ranks.__getitem__, self.strings)
+            )
+        return self._index('strings', build)
+
+    def _where_strings(self, column, ranges):
+        """Select rows of a string column whose string's rank is in one
+        of the [low, high) ranges"""
+        def build():
+            ranks = self._sorted_strings()[1]
+            values = array.array(
+                'l',
+                map(ranks.__getitem__, getattr(self, column))
+            )
+            order = array.array('l', sorted(
+                range(len(values)),
+                key=values.__getitem__
+            ))
+            return array.array(
+                'l',
+                map(values.__getitem__, order)
+            ), order
+        values, order = self._index(column + '_strings', build)
+        return self._select(self._mark(chain.from_iterable(
+            order[
+                bisect.bisect_left(values, low):
+                bisect.bisect_left(values, high)
+            ]
+            for low, high in ranges
+        )))
+
+    def under(self, path):
+        """Select the shares of path and everything below it"""
+        path = normalize_path(path)
+        prefix = path.rstrip('/') + '/'
+        strings = self._sorted_strings()[0]
+        # Everything starting with prefix, which sorts before prefix with
+        # its last character ('/') bumped to '0', and path itself
+        ranges = [(
+            bisect.bisect_left(strings, prefix),
+            bisect.bisect_left(strings, prefix[:-1] + '0')
+        )]
+        if prefix != path:
+            ranges.append((
+                bisect.bisect_left(strings, path),
+                bisect.bisect_right(strings, path)
+            ))
+        return self._where_strings('paths', ranges)
+
+    def shared_with(self, *names):
+        """Select shares with the given users or groups"""
+        strings = self._sorted_strings()[0]
+        ranges = []
+        for name in set(names):
+            if name is None:
+                continue
+            rank = bisect.bisect_left(strings, name)
+            if rank < len(strings) and strings[rank] == name:
+                ranges.append((rank, rank + 1))
+        return self._where_strings('share_withs', ranges)
+
+    def duplicates(self):
+        """Select all but the oldest of the selected shares of the same
+        path, share_type and share_with
+
+        share_with is ignored for public links, so every link to a path
+        but the first is selected.
+        """
+        ids, order = self._sorted('ids')
+        if self._mask is not None:
+            order = compress(order, map(self._mask.__getitem__, order))
+        newest_first = array.array('l', order)
+        newest_first.reverse()
+        share_withs = self._index('share_with_keys', lambda: array.array(
+            'l',
+            [
+                -1 if share_type == SHARETYPE_PUBLIC else share_with
+                for share_type, share_with
+                in zip(self.share_types, self.share_withs)
+            ]
+        ))
+        keys = zip(
+            map(self.paths.__getitem__, newest_first),
+            map(self.share_types.__getitem__, newest_first),
+            map(share_withs.__getitem__, newest_first)
+        )
+        # Later rows replace earlier ones, leaving the oldest of each key
+        oldest = self._mark(dict(zip(keys, newest_first)).values())
+        selected = self._mask or b'\x01' * len(self.ids)
+        return self._select((
+            int.from_bytes(selected, 'little') &
+            ~int.from_bytes(oldest, 'little')
+        ).to_bytes(len(selected), 'little'))
+
+    def plan_update(self, permissions=None, allow=0, deny=0, password=None,
+                    public_upload=None, expire_date=None):
+        """Return a SharePlan updating every selected share
+
+        Takes the update_share_by_id arguments, and allow and deny
+        PERMISSION_* bits to add to and remove from each share's own
+        permissions (after applying permissions, if given). Shares whose
+        permissions wouldn't change get no update unless other arguments
+        are given.
+        """
+        plan = SharePlan()
+        for share in self:
+            current = share.permissions
+            wanted = current if permissions is None else permissions
+            wanted = (wanted | allow) & ~deny
+            changes = update_changes(
+                wanted if wanted != current else None,
+                password,
+                public_upload,
+                expire_date
+            )
+            if changes:
+                plan.add('update', share, changes)
+        return plan
+
+    def plan_delete(self):
+        """Return a SharePlan deleting every selected share"""
+        plan = SharePlan()
+        for share in self:
+            plan.add('delete', share)
+        return plan
+
+    def _folders(self):
+        """Return the top level folders, and the folder of each row"""
+        names = []
+        folder_ids = {}
+        folders = {}
+        for string_id in set(self.paths):
+            folder = self.strings[string_id]
+            if folder is not None:
+                folder = '/' + folder.strip('/').split('/', 1)[0]
+            if folder not in folder_ids:
+                folder_ids[folder] = len(names)
+                names.append(folder)
+            folders[string_id] = folder_ids[folder]
+        return names, array.array('l', map(folders.__getitem__, self.paths))
+
+    def count_by(self, column):
+        """Count the selected rows by a column
+
+        column is one of 'share_type', 'permissions', 'path', 'share_with'
+        or 'folder' (the top level folder of the share's path).
+        """
+        names = self.strings
+        if column == 'folder':
+            names, values = self._index('folders', self._folders)
+        else:
+            values = {
+                'share_type': self.share_types,
+                'permissions': self.permissions,
+                'path': self.paths,
+                'share_with': self.share_withs
+            }[column]
+        if self._mask is not None:
+            values = compress(values, self._mask)
+        counts = Counter(values)
+        if column in ('path', 'share_with', 'folder'):
+            return Counter(dict(
+                (names[string_id], count)
+                for string_id, count in counts.items()
+            ))
+        return counts
+
+
+def update_changes(permissions=None, password=None, public_upload=None,
+                   expire_date=None):
+    """Return the update_share_by_id arguments that were given as a dict"""
+    changes = {
+        'permissions': permissions,
+        'password': password,
+        'public_upload': public_upload,
+        'expire_date': expire_date
+    }
+    return dict((k, v) for k, v in changes.items() if v is not None)
+
+
+class ShareUpdateQueue:
+    """Write-behind queue that merges updates to the same share
+
+    Changes passed to update() are merged per share id, later values
+    replacing earlier ones, and sent as one update_share_by_id call per
+    share when the queue is flushed: delay seconds after the last change,
+    or when flush() is called. Get one from OCShareAPI.update_queue().
+
+    Keyword arguments:
+        ocshareapi -- The client to send updates through
+        delay -- Seconds of quiet before flushing by itself, or None to
+                 only flush when flush() is called (default 0.5)
+        callback -- Called as callback(share_id, exception) for every
+                    share sent, exception being None on success
+    """
+
+    def __init__(self, ocshareapi, delay=0.5, callback=None):
+        self.ocshareapi = ocshareapi
+        self.delay = delay
+        self.callback = callback
+        self._pending = OrderedDict()
+        self._timer = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def update(self, share_id, permissions=None, password=None,
+               public_upload=None, expire_date=None):
+        """Queue changes to a share, see OCShareAPI.update_share_by_id"""
+        changes = update_changes(
+            permissions, password, public_upload, expire_date
+        )
+        with self._lock:
+            self._pending.setdefault(share_id, {}).update(changes)
+            if self.delay is not None:
+                if self._timer is not None:
+                    self._timer.cancel()
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def discard(self, share_id):
+        """Drop queued changes to a share, eg when it has been deleted"""
+        with self._lock:
+            self._pending.pop(share_id, None)
+
+    def flush(self):
+        """Send all queued changes now
+
+        Returns a dict of share id to None for the shares updated, or the
+        exception raised updating that share.
+        """
+        with self._flush_lock:
+            return self.send(self.take())
+
+    def take(self):
+        """Remove the queued changes and return them, for send()
+
+        For callers that need to know what was sent, as a dict of share
+        id to update_share_by_id keyword arguments.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, OrderedDict()
+        return pending
+
+    def send(self, pending):
+        """Send changes returned by take(), see flush()"""
+        with self._flush_lock:
+            results = OrderedDict()
+            for share_id, changes in pending.items():
+                try:
+                    self.ocshareapi.update_share_by_id(share_id, **changes)
+                except Exception as e:
+                    results[share_id] = e
+                else:
+                    results[share_id] = None
+                if self.callback is not None:
+                    self.callback(share_id, results[share_id])
+            return results
+
+    def close(self):
+        """Flush whatever is still queued"""
+        return self.flush()
+
+
+class ShareCatalog:
+    """Indexed, in-memory collection of shares
+
+    Build one from a full get_shares() listing to look shares up by id,
+    path, share_with, token, share_type or item_source in constant time,
+    and to find every share under a folder with under(). Register it on
+    the client with OCShareAPI.add_listener (or build it with from_api)
+    to keep it in step with shares changed through that client.
+
+    share_with isn't indexed for public links, where the server uses it to
+    hold the password hash.
+    """
+
+    def __init__(self, shares=()):
+        self._lock = threading.RLock()
+        self._shares = {}
+        self._by_path = {}
+        self._by_share_with = {}
+        self._by_token = {}
+        self._by_share_type = {}
+        self._by_item_source = {}
+        self._paths = []
+        for share in shares:
+            self._index(share)
+        self._paths = sorted(self._by_path)
+
+    @classmethod
+    def from_api(cls, ocshareapi, **kwargs):
+        """Build a catalog from ocshareapi.get_shares(**kwargs) and keep it
+        up to date with changes made through ocshareapi"""
+        catalog = cls(ocshareapi.get_shares(**kwargs))
+        ocshareapi.add_listener(catalog)
+        return catalog
+
+    def __len__(self):
+        return len(self._shares)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._shares.values()))
+
+    def __contains__(self, share_id):
+        return share_id in self._shares
+
+    def _indexes(self, share):
+        yield self._by_path, normalize_path(share.path)
+        if share.share_type != SHARETYPE_PUBLIC:
+            yield self._by_share_with, share.share_with
+        yield self._by_share_type, share.share_type
+        yield self._by_item_source, share.item_source
+
+    def _index(self, share):
+        self._shares[share.id] = share
+        for index, key in self._indexes(share):
+            index.setdefault(key, {})[share.id] = share
+        if share.token:
+            self._by_token[share.token] = share
+
+    def add(self, share):
+        """Add or replace a share"""
+        with self._lock:
+            self.remove(share.id)
+            path = normalize_path(share.path)
+            if path not in self._by_path:
+                bisect.insort(self._paths, path)
+            self._index(share)
+
+    def remove(self, share_id):
+        """Remove a share, if present"""
+        with self._lock:
+            share = self._shares.pop(share_id, None)
+            if share is None:
+                return
+            for index, key in self._indexes(share):
+                bucket = index[key]
+                del bucket[share_id]
+                if not bucket:
+                    del index[key]
+                    if index is self._by_path:
+                        self._paths.pop(bisect.bisect_left(self._paths, key))
+            if share.token:
+                self._by_token.pop(share.token, None)
+
+    def get(self, share_id):
+        return self._shares.get(share_id)
+
+    def _lookup(self, index, key):
+        with self._lock:
+            return list(index.get(key, {}).values())
+
+    def by_path(self, path):
+        return self._lookup(self._by_path, normalize_path(path))
+
+    def by_share_with(self, share_with):
+        return self._lookup(self._by_share_with, share_with)
+
+    def by_share_type(self, share_type):
+        return self._lookup(self._by_share_type, share_type)
+
+    def by_item_source(self, item_source):
+        return self._lookup(self._by_item_source, item_source)
+
+    def by_token(self, token):
+        return self._by_token.get(token)
+
+    def under(self, path):
+        """Return the shares of path and everything below it"""
+        path = normalize_path(path)
+        prefix = path.rstrip('/') + '/'
+        shares = []
+        with self._lock:
+            i = bisect.bisect_left(self._paths, path)
+            while i < len(self._paths):
+                p = self._paths[i]
+                if not p.startswith(path):
+                    break
+                if p == path or p.startswith(prefix):
+                    shares.extend(self._by_path[p].values())
+                i += 1
+        return shares
+
+    def share_created(self, share):
+        self.add(share)
+
+    def share_updated(self, share_id, changes):
+        share = self.get(share_id)
+        if share is None:
+            return
+        if 'permissions' in changes:
+            share.permissions = changes['permissions']
+        if 'expire_date' in changes:
+            if changes['expire_date']:
+                share.expiration = changes['expire_date'].strftime(
+                    '%Y-%m-%d 00:00:00'
+                )
+            else:
+                share.expiration = None
+
+    def share_deleted(self, share_id):
+        self.remove(share_id)
+
+
+def share_key(path, share_type, share_with=None):
+    """Identify a share by (path, share_type, share_with)
+
+    share_with is left out of public links, where the server uses it to
+    hold the password hash.
+    """
+    if share_type == SHARETYPE_PUBLIC:
+        share_with = None
+    return (normalize_path(path), share_type, share_with)
+
+
+def describe_share(path, share_type, share_with=None):
+    """Return eg "/Projects/X group Developers" for messages"""
+    if share_type == SHARETYPE_PUBLIC:
+        return '%s public link' % path
+    kind = {SHARETYPE_USER: 'user', SHARETYPE_GROUP: 'group'}.get(
+        share_type, 'type %s' % share_type
+    )
+    return '%s %s %s' % (path, kind, share_with)
+
+
+class ShareManifest:
+    """Shares declared as configuration, to reconcile the server with
+
+    A manifest is a JSON document like
+
+        {"manage": ["/Projects"],
+         "shares": [
+            {"path": "/Projects/X", "share_type": 1,
+             "share_with": "Developers", "permissions": 1},
+            {"path": "/Projects/X", "share_type": 3,
+             "expire_date": "2026-12-31"}
+         ]}
+
+    Shares are identified by (path, share_type, share_with), share_with
+    being left out for public links. permissions and expire_date
+    (YYYY-MM-DD, or null for none) are kept as declared when given.
+    password and public_upload are only used when creating, as the server
+    doesn't return them. Undeclared shares of the paths listed in shares,
+    or under the folders listed in manage, are deleted.
+
+    Keyword arguments:
+        shares -- Iterable of share dicts as above
+        manage -- Folders whose undeclared shares are deleted
+    """
+
+    FIELDS = frozenset([
+        'path', 'share_type', 'share_with', 'permissions', 'expire_date',
+        'password', 'public_upload'
+    ])
+
+    def __init__(self, shares, manage=()):
+        from datetime import datetime
+        self.shares = OrderedDict()
+        self.manage = [normalize_path(path) for path in manage]
+        for spec in shares:
+            spec = dict(spec)
+            unknown = set(spec) - self.FIELDS
+            if unknown:
+                raise ValueError(
+                    'unknown share fields %s' % ', '.join(sorted(unknown))
+                )
+            if 'path' not in spec or 'share_type' not in spec:
+                raise ValueError('shares need a path and share_type')
+            if (spec['share_type'] != SHARETYPE_PUBLIC and
+                    not spec.get('share_with')):
+                raise ValueError('%s needs share_with' % describe_share(
+                    spec['path'], spec['share_type']
+                ))
+            if spec.get('expire_date'):
+                spec['expire_date'] = datetime.strptime(
+                    spec['expire_date'], '%Y-%m-%d'
+                ).date()
+            key = share_key(
+                spec['path'], spec['share_type'], spec.get('share_with')
+            )
+            if key in self.shares:
+                raise ValueError('%s is declared twice' % describe_share(
+                    *key
+                ))
+            self.shares[key] = spec
+
+    @classmethod
+    def load(cls, fp):
+        """Read a manifest from a JSON file object"""
+        document = json.load(fp)
+        return cls(document.get('shares', ()), document.get('manage', ()))
+
+    def managed(self, path):
+        """Return whether undeclared shares of path are deleted"""
+        path = normalize_path(path)
+        for folder in self.manage:
+            if (path == folder or
+                    path.startswith(folder.rstrip('/') + '/')):
+                return True
+        return False
+
+    def plan(self, shares):
+        """Return the SharePlan turning shares into the declared ones
+
+        shares should be a full get_shares() listing, so a whole manifest
+        is reconciled with a single listing call. When a share is
+        declared once but exists several times, the oldest is kept and
+        the others deleted.
+        """
+        current = OrderedDict()
+        for share in sorted(shares, key=lambda share: share.id):
+            key = share_key(share.path, share.share_type, share.share_with)
+            current.setdefault(key, []).append(share)
+        paths = set(key[0] for key in self.shares)
+        plan = SharePlan()
+        for key, spec in self.shares.items():
+            existing = current.pop(key, [])
+            if not existing:
+                plan.add('create', changes=spec)
+                continue
+            for duplicate in existing[1:]:
+                plan.add('delete', duplicate)
+            changes = self._changes(spec, existing[0])
+            if changes:
+                plan.add('update', existing[0], changes)
+        for key, existing in current.items():
+            if key[0] in paths or self.managed(key[0]):
+                for share in existing:
+                    plan.add('delete', share)
+        return plan
+
+    @staticmethod
+    def _changes(spec, share):
+        """Return the update_share_by_id arguments share needs"""
+        changes = {}
+        if ('permissions' in spec and
+                spec['permissions'] != share.permissions):
+            changes['permissions'] = spec['permissions']
+        if 'expire_date' in spec:
+            want = spec['expire_date']
+            have = share.expiration[:10] if share.expiration else None
+            if want is None and have is not None:
+                changes['expire_date'] = False
+            elif want is not None and want.isoformat() != have:
+                changes['expire_date'] = want
+        return changes
+
+
+class SharePlan:
+    """Create, update and delete steps, see ShareManifest.plan
+
+    Each step is an (action, share, changes) tuple: ('create', None,
+    create spec), ('update', share, update_share_by_id arguments) or
+    ('delete', share, None).
+    """
+
+    def __init__(self):
+        self.steps = []
+
+    def __len__(self):
+        return len(self.steps)
+
+    def add(self, action, share=None, changes=None):
+        self.steps.append((action, share, changes))
+
+    def counts(self):
+        """Return the number of steps of each action"""
+        return Counter(step[0] for step in self.steps)
+
+    @staticmethod
+    def describe(step):
+        """Return a line describing a step"""
+        action, share, changes = step
+        if action == 'create':
+            return 'create %s%s' % (
+                describe_share(
+                    changes['path'],
+                    changes['share_type'],
+                    changes.get('share_with')
+                ),
+                ''.join(
+                    ' %s=%s' % (name, changes[name])
+                    for name in ('permissions', 'expire_date')
+                    if changes.get(name) is not None
+                )
+            )
+        line = '%s #%d %s' % (action, share.id, describe_share(
+            share.path, share.share_type, share.share_with
+        ))
+        if action == 'update':
+            before = {
+                'permissions': share.permissions,
+                'expire_date': share.expiration[:10]
+                if share.expiration else None
+            }
+            for name, value in sorted(changes.items()):
+                line += ' %s=%s->%s' % (
+                    name, before.get(name), None if value is False else value
+                )
+        return line
+
+    def execute(self, ocshareapi, controller=None, callback=None):
+        """Perform the steps concurrently through ocshareapi.run_bulk
+
+        Keyword arguments:
+            ocshareapi -- The OCShareAPI to make the changes with
+            controller -- ConcurrencyController pacing the requests
+            callback -- Called as callback(step, result) as each step
+                        finishes, from the worker threads
+
+        Returns a list in the same order as steps, holding the created
+        OCShare or None, or the exception raised performing that step.
+        """
+        def perform(step):
+            try:
+                result = self._perform(ocshareapi, step)
+            except Exception as e:
+                result = e
+            if callback is not None:
+                callback(step, result)
+            return result
+
+        return ocshareapi.run_bulk(perform, self.steps, controller)
+
+    @staticmethod
+    def _perform(ocshareapi, step):
+        action, share, changes = step
+        if action == 'delete':
+            return ocshareapi.delete_share_by_id(share.id)
+        if action == 'update':
+            return ocshareapi.update_share_by_id(share.id, **changes)
+        share = ocshareapi.create_share(
+            path=changes['path'],
+            share_type=changes['share_type'],
+            share_with=changes.get('share_with'),
+            public_upload=changes.get('public_upload', False),
+            password=changes.get('password'),
+            permissions=changes.get('permissions')
+        )
+        # Creating can't set the expiry date
+        if changes.get('expire_date'):
+            ocshareapi.update_share_by_id(
+                share.id,
+                expire_date=changes['expire_date']
+            )
+        return share
+
+
+def plan_tree(ocshareapi, local_path, share_type, share_with=None,
+              permissions=None, public_upload=False, password=None,
+              max_depth=None, to_cloud=None, controller=None):
+    """Plan sharing a local file or folder and everything under it
+
+    Walks local_path, maps each entry to the cloud with to_cloud, and
+    lists the existing shares with one get_shares(subfiles=True) call per
+    folder (made concurrently through ocshareapi.run_bulk), so entries
+    already shared the same way are skipped. The cloud root itself can't
+    be shared, when local_path maps to it only what is under it is.
+
+    Keyword arguments:
+        local_path -- The local file or folder to share
+        share_type, share_with, permissions, public_upload, password --
+            How to share every entry, see OCShareAPI.create_share
+        max_depth -- Levels below local_path to share, None for all
+        to_cloud -- Maps a local path to its cloud path or None, defaults
+                    to full_path_to_cloud
+        controller -- ConcurrencyController pacing the listing calls
+
+    Returns a SharePlan of the creates to make.
+    """
+    if to_cloud is None:
+        to_cloud = full_path_to_cloud
+    root = os.path.abspath(local_path)
+    root_cloud = to_cloud(root)
+    if root_cloud is None:
+        raise ValueError('%s is not in a sync folder' % local_path)
+
+    is_root = not root_cloud.strip('/')
+    entries = [] if is_root else [root_cloud]
+    folders = []
+    if os.path.isdir(root):
+        root_depth = root.rstrip(os.sep).count(os.sep)
+        for dirpath, dirnames, filenames in os.walk(root):
+            depth = dirpath.rstrip(os.sep).count(os.sep) - root_depth
+            if max_depth is not None and depth >= max_depth:
+                dirnames[:] = []
+                continue
+            dirnames.sort()
+            children = [
+                to_cloud(os.path.join(dirpath, name))
+                for name in sorted(dirnames + filenames)
+            ]
+            folders.append(to_cloud(dirpath))
+            entries.extend(child for child in children if child is not None)
+
+    def listing(request):
+        path, subfiles = request
+        try:
+            return ocshareapi.get_shares(path=path, subfiles=subfiles)
+        except OCShareException as e:
+            # 404 when nothing there is shared
+            if e.status_code == 404:
+                return []
+            raise
+
+    listings = [(folder, True) for folder in folders]
+    if not is_root:
+        listings.insert(0, (root_cloud, None))
+    existing = set()
+    for shares in ocshareapi.run_bulk(listing, listings, controller):
+        if isinstance(shares, Exception):
+            raise shares
+        for share in shares:
+            existing.add(
+                share_key(share.path, share.share_type, share.share_with)
+            )
+
+    spec = {
+        'share_type': share_type,
+        'share_with': share_with,
+        'permissions': permissions,
+        'public_upload': public_upload,
+        'password': password
+    }
+    plan = SharePlan()
+    for path in entries:
+        if share_key(path, share_type, share_with) not in existing:
+            plan.add('create', changes=dict(spec, path=path))
+    return plan
+
+
+def clean_params(params):
+    """Drop unset values and stringify the rest, the way requests would"""
+    return dict(
+        (k, str(v)) for k, v in params.items() if v is not None
+    )
+
+
+# Statuses meaning the server is overloaded, a request failing with one of
+# these was most likely not processed and is safe to repeat.
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'PROPFIND'])
+
+
+def parse_retry_after(value):
+    """Return the seconds a Retry-After header asks to wait, or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    import email.utils
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class ConcurrencyController:
+    """Adaptive limit on the requests a client has in flight
+
+    The limit grows additively, by about one per round trip, while
+    responses come back as fast as usual, and is cut multiplicatively
+    when the server throttles (429, 5xx, connection errors) or the
+    latency climbs above latency_factor times its usual level, so bulk
+    operations settle on what the server can sustain. Throttled requests
+    are retried after a jittered exponential backoff, or after the delay
+    the server asks for in Retry-After. Only idempotent requests (and
+    requests refused with 429, which weren't processed) are retried.
+
+    Keyword arguments:
+        initial -- Requests allowed in flight to begin with (default 2)
+        minimum -- Lowest the limit backs off to (default 1)
+        maximum -- Highest the limit grows to (default 16)
+        latency_factor -- Latency over the usual level that counts as a
+                          spike (default 2.0)
+        decrease -- Factor the limit is cut by on throttling (default 0.5)
+        retries -- Times a throttled request is retried (default 4)
+        backoff -- Base of the retry backoff in seconds (default 0.5)
+        max_backoff -- Longest wait before a retry in seconds (default 30)
+    """
+
+    def __init__(self, initial=2, minimum=1, maximum=16, latency_factor=2.0,
+                 decrease=0.5, retries=4, backoff=0.5, max_backoff=30):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.latency_factor = latency_factor
+        self.decrease = decrease
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.in_flight = 0
+        self.throttled = 0
+        self.retried = 0
+        self.baseline = None
+        self.latency = None
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Wait until another request may be sent"""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, throttled=False):
+        """Record the outcome of a request started with acquire()
+
+        Keyword arguments:
+            latency -- Seconds the request took, None if it failed
+            throttled -- Whether the server was overloaded
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if latency is not None:
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency += (latency - self.latency) * 0.2
+                # The baseline follows falling latency quickly, and rising
+                # latency slowly, in case the server got slower for good
+                if self.baseline is None:
+                    self.baseline = latency
+                elif latency < self.baseline:
+                    self.baseline += (latency - self.baseline) * 0.2
+                else:
+                    self.baseline += (latency - self.baseline) * 0.02
+            spike = (
+                latency is not None and
+                self.latency > self.baseline * self.latency_factor
+            )
+            if throttled:
+                self.throttled += 1
+            if throttled or spike:
+                # Requests in flight together report the same congestion,
+                # only back off once per round trip
+                now = time.monotonic()
+                if now - self._last_decrease >= (self.latency or 0.0):
+                    self.limit = max(
+                        self.minimum, self.limit * self.decrease
+                    )
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def retry_delay(self, method, attempt, status=None, retry_after=None):
+        """Return the seconds to wait before retrying, or None to give up
+
+        Keyword arguments:
+            method -- HTTP method of the failed request
+            attempt -- Number of retries already made
+            status -- HTTP status, None for connection errors
+            retry_after -- The response's Retry-After header
+        """
+        if attempt >= self.retries:
+            return None
+        if method.upper() not in IDEMPOTENT_METHODS and status != 429:
+            return None
+        if status is not None and status not in RETRY_STATUSES:
+            return None
+        self.retried += 1
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = random.uniform(
+                0, min(self.max_backoff, self.backoff * 2 ** attempt)
+            )
+        return min(delay, self.max_backoff)
+
+    def stats(self):
+        """Return the current limit and counters as a dict"""
+        return {
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'throttled': self.throttled,
+            'retried': self.retried,
+            'latency': self.latency,
+            'baseline': self.baseline
+        }
+
+
+OPERATIONS = {
+    ('GET', '/shares'): 'get_shares',
+    ('POST', '/shares'): 'create_share',
+    ('GET', '/shares/'): 'get_share',
+    ('PUT', '/shares/'): 'update_share',
+    ('DELETE', '/shares/'): 'delete_share'
+}
+
+
+def operation_name(method, path):
+    """Name the share API operation a request performs, eg get_shares"""
+    if method.upper() == 'PROPFIND':
+        return 'list_folder'
+    key = (method.upper(), '/shares/' if path.count('/') > 1 else '/shares')
+    return OPERATIONS.get(key, '%s %s' % key)
+
+
+class Metrics:
+    """Counts and times the requests made by a client
+
+    Pass one to OCShareAPI or AsyncOCShareAPI as metrics, and read the
+    numbers back with stats() or summary(). The clients only call the
+    methods below, so any object having them can be passed instead, eg
+    to forward the measurements to another monitoring system.
+
+    Operations are named after the client method making the request:
+    get_shares, get_share, create_share, update_share, delete_share and
+    list_folder.
+    """
+
+    # Upper bounds of the latency histogram buckets, in seconds
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+               2.5, 5, 10)
+
+    def __init__(self):
+        self.operations = OrderedDict()
+        self.http_statuses = Counter()
+        self.ocs_statuses = Counter()
+        self.retries = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.decode_seconds = 0.0
+        self.decoded_bytes = 0
+        self.build_seconds = 0.0
+        self.shares_built = 0
+        self._lock = threading.Lock()
+
+    def request(self, operation, seconds, status=None, sent=None,
+                received=None):
+        """Record a finished request
+
+        Keyword arguments:
+            operation -- Name of the operation, see operation_name()
+            seconds -- Time from sending the request to reading the
+                       response, including any retries
+            status -- HTTP status, None if no response came back
+            sent -- Bytes sent, None if unknown
+            received -- Bytes received, None if unknown
+        """
+        with self._lock:
+            entry = self.operations.get(operation)
+            if entry is None:
+                entry = self.operations[operation] = {
+                    'count': 0,
+                    'errors': 0,
+                    'seconds': 0.0,
+                    'max': 0.0,
+                    'histogram': [0] * (len(self.BUCKETS) + 1)
+                }
+            entry['count'] += 1
+            if status is None or status >= 400:
+                entry['errors'] += 1
+            entry['seconds'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            entry['histogram'][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            self.http_statuses[status] += 1
+            if sent is not None:
+                self.bytes_sent += sent
+            if received is not None:
+                self.bytes_received += received
+
+    def retried(self, operation, status=None):
+        """Record a request being retried after status (None if failed)"""
+        with self._lock:
+            self.retries[(operation, status)] += 1
+
+    def ocs_status(self, operation, statuscode):
+        """Record the OCS status code of a response, as checked"""
+        with self._lock:
+            self.ocs_statuses[(operation, statuscode)] += 1
+
+    def decoded(self, seconds, size):
+        """Record size bytes of JSON taking seconds to decode"""
+        with self._lock:
+            self.decode_seconds += seconds
+            self.decoded_bytes += size
+
+    def built(self, seconds, count):
+        """Record count OCShare objects taking seconds to construct"""
+        with self._lock:
+            self.build_seconds += seconds
+            self.shares_built += count
+
+    def percentile(self, operation, fraction):
+        """Return the bucket bound under which fraction of the operation's
+        requests finished, None when above the last bucket"""
+        entry = self.operations[operation]
+        wanted = fraction * entry['count']
+        seen = 0
+        for bound, count in zip(self.BUCKETS, entry['histogram']):
+            seen += count
+            if seen >= wanted:
+                return bound
+        return None
+
+    def stats(self):
+        """Return every measurement as a JSON serialisable dict"""
+        with self._lock:
+            operations = OrderedDict()
+            for name, entry in self.operations.items():
+                operations[name] = dict(entry, histogram=OrderedDict(
+                    ('le_%s' % bound, count) for bound, count in zip(
+                        self.BUCKETS + ('inf',), entry['histogram']
+                    )
+                ))
+            return {
+                'operations': operations,
+                'http_statuses': dict(
+                    (str(status), count)
+                    for status, count in self.http_statuses.items()
+                ),
+                'ocs_statuses': dict(
+                    ('%s %s' % key, count)
+                    for key, count in self.ocs_statuses.items()
+                ),
+                'retries': dict(
+                    ('%s %s' % key, count)
+                    for key, count in self.retries.items()
+                ),
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'decode_seconds': self.decode_seconds,
+                'decoded_bytes': self.decoded_bytes,
+                'build_seconds': self.build_seconds,
+                'shares_built': self.shares_built
+            }
+
+    def summary(self):
+        """Return the measurements as a human readable table"""
+        def bound(value):
+            if value is None:
+                return '>%gs' % self.BUCKETS[-1]
+            return '<=%gs' % value
+
+        lines = ['%-14s %6s %6s %9s %9s %9s %9s' % (
+            'operation', 'count', 'errors', 'total', 'max', 'p50', 'p95'
+        )]
+        for name, entry in list(self.operations.items()):
+            lines.append('%-14s %6d %6d %8.3fs %8.3fs %9s %9s' % (
+                name,
+                entry['count'],
+                entry['errors'],
+                entry['seconds'],
+                entry['max'],
+                bound(self.percentile(name, 0.5)),
+                bound(self.percentile(name, 0.95))
+            ))
+        lines.append('http statuses: %s' % ', '.join(
+            '%s x%d' % item for item in sorted(
+                self.http_statuses.items(), key=lambda item: str(item[0])
+            )
+        ))
+        lines.append('ocs statuses: %s' % ', '.join(
+            '%s %s x%d' % (key + (count,))
+            for key, count in sorted(self.ocs_statuses.items())
+        ))
+        if self.retries:
+            lines.append('retries: %s' % ', '.join(
+                '%s after %s x%d' % (key + (count,))
+                for key, count in sorted(
+                    self.retries.items(), key=lambda item: str(item[0])
+                )
+            ))
+        lines.append('bytes sent: %d, received: %d' % (
+            self.bytes_sent, self.bytes_received
+        ))
+        lines.append('json decoding: %.3fs for %d bytes' % (
+            self.decode_seconds, self.decoded_bytes
+        ))
+        lines.append('share construction: %.3fs for %d shares' % (
+            self.build_seconds, self.shares_built
+        ))
+        return '\n'.join(lines)
+
+
+class OCShareAPIBase:
+    """Request building and response handling shared by the API clients
+
+    Each *_request method returns a (method, path, kwargs) tuple describing
+    the HTTP request for an operation, and the matching *_result method
+    turns the checked json feed into the operation's return value. The
+    transports (OCShareAPI and ocsharetools_async.AsyncOCShareAPI) only
+    perform the request in between.
+    """
+
+    def __init__(self, url, username, password,
+                 disable_ssl_verification=False, cache=None, metrics=None):
         self.username = username
         self.password = password
         self.url = url
         self.disable_ssl_verification = disable_ssl_verification
+        self.cache = cache
+        self.metrics = metrics
+        self.listeners = []
+        self.api_url = '%s%s' % (url, API_PATH)
+
+    def add_listener(self, listener):
+        """Tell listener about shares changed through this client
+
+        listener.share_created(share), listener.share_updated(share_id,
+        changes) and listener.share_deleted(share_id) are called after each
+        successful create, update and delete. changes is a dict of the
+        update_share_by_id arguments that were given.
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def _notify(self):
+        if self.cache is not None:
+            return [self.cache] + self.listeners
+        return self.listeners
+
+    def _share_created(self, share):
+        for listener in self._notify():
+            listener.share_created(share)
+
+    @contextlib.contextmanager
+    def _updating(self, share_id, changes):
+        """Wrap the request updating a share
+
+        The cache forgets the share whatever happens, as an update that
+        failed or timed out may still have been applied by the server.
+        Listeners only hear of updates that succeeded.
+        """
+        try:
+            yield
+        finally:
+            if self.cache is not None:
+                self.cache.share_updated(share_id, changes)
+        for listener in self.listeners:
+            listener.share_updated(share_id, changes)
+
+    def _share_deleted(self, share_id):
+        for listener in self._notify():
+            listener.share_deleted(share_id)
+
+    def _check_status(self, operation, jsonfeed):
+        """check_status, recording the OCS status code in metrics"""
+        if self.metrics is not None:
+            self.metrics.ocs_status(
+                operation,
+                jsonfeed['ocs']['meta']['statuscode']
+            )
+        check_status(jsonfeed)
+
+    def _decode(self, body):
+        """Decode a json response body, timing it for metrics"""
+        if self.metrics is None:
+            return json.loads(body)
+        start = time.perf_counter()
+        jsonfeed = json.loads(body)
+        self.metrics.decoded(time.perf_counter() - start, len(body))
+        return jsonfeed
+
+    def _build_shares(self, datas):
+        """Return an OCShare for every share dict in datas"""
+        if self.metrics is None:
+            return [OCShare(self, **data) for data in datas]
+        start = time.perf_counter()
+        shares = [OCShare(self, **data) for data in datas]
+        self.metrics.built(time.perf_counter() - start, len(shares))
+        return shares
+
+    def _query(self, params=None):
+        query = {'format': 'json'}
+        if params:
+            query.update(params)
+        return clean_params(query)
+
+    def _get_shares_request(self, path=None, reshares=None, subfiles=None):
+        return 'GET', '/shares', {
+            'params': self._query({
+                'path': path,
+                'reshares': reshares,
+                'subfiles': subfiles
+            })
+        }
+
+    def _get_shares_result(self, jsonfeed):
+        return self._build_shares(jsonfeed['ocs']['data'])
+
+    def _get_share_by_id_request(self, share_id):
+        return 'GET', '/shares/%d' % share_id, {'params': self._query()}
+
+    def _get_share_by_id_result(self, jsonfeed):
+        return self._build_shares(jsonfeed['ocs']['data'][:1])[0]
+
+    def _create_share_request(self, path, share_type, share_with=None,
+                              public_upload=False, password=None,
+                              permissions=None):
+        return 'POST', '/shares', {
+            'params': self._query(),
+            'allow_redirects': False,
+            'data': clean_params({
+                'path': path,
+                'shareType': share_type,
+                'shareWith': share_with,
+                'publicUpload': int(public_upload),
+                'password': password,
+                'permissions': permissions
+            })
+        }
+
+    def _create_share_result(self, jsonfeed):
+        """Build the created share from a create response
+
+        Returns None when the response lacks some of SHARE_FIELDS, the
+        share then has to be fetched by id.
+        """
+        data = jsonfeed['ocs']['data']
+        if SHARE_FIELDS.issubset(data):
+            return self._build_shares([data])[0]
+        return None
+
+    def _delete_share_by_id_request(self, share_id):
+        return 'DELETE', '/shares/%d' % share_id, {'params': self._query()}
+
+    def _update_share_by_id_request(self, share_id, permissions=None,
+                                    password=None, public_upload=None,
+                                    expire_date=None):
+        if expire_date:
+            expire_date = expire_date.strftime('%d-%m-%Y')
+        elif expire_date is False:
+            expire_date = ''
+
+        if password is False:
+            password = ''
+        return 'PUT', '/shares/%d' % share_id, {
+            'params': self._query(),
+            'data': clean_params({
+                'permissions': permissions,
+                'password': password,
+                'publicUpload': public_upload,
+                'expireDate': expire_date
+            })
+        }
+
+
+class OCShareAPI(OCShareAPIBase):
+    def __init__(self, url, username, password, disable_ssl_verification=False,
+                 pool_size=10, cache=None, controller=None, metrics=None):
+        """Initialise the API client
+
+        The client keeps a pool of keep-alive connections to the server,
+        which is shared by every thread using this client. Call close()
+        (or use the client as a context manager) when done with it.
+
+        Keyword arguments:
+            url -- Your ownCloud url, eg https://example.com/owncloud
+            username -- Your ownCloud username
+            password -- Your ownCloud password
+            disable_ssl_verification -- Don't verify the server certificate
+            pool_size -- Maximum number of connections kept open to the
+                         server (default 10)
+            cache -- A ShareCache to cache listings and shares in, or None
+                     to always ask the server (default None)
+            controller -- A ConcurrencyController to pace and retry every
+                          request through, by default only the bulk
+                          operations use one
+            metrics -- A Metrics to record requests in (default None)
+        """
+        super().__init__(
+            url, username, password, disable_ssl_verification, cache, metrics
+        )
+        import requests.adapters
+        self.pool_size = pool_size
+        self.controller = controller
+        self._adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True
+        )
+        self._local = threading.local()
+        # Weak, so the session of a thread that has ended goes with it
+        self._sessions = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close all pooled connections"""
+        with self._lock:
+            sessions = list(self._sessions)
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+        self._adapter.close()
+
+    @property
+    def session(self):
+        """The requests session for the calling thread
+
+        requests.Session objects aren't safe to share between threads, so
+        each thread gets its own, but they all share one connection pool.
+        A thread's session is dropped when the thread ends.
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            import requests
+            session = requests.Session()
+            session.auth = (self.username, self.password)
+            session.verify = not self.disable_ssl_verification
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            with self._lock:
+                self._sessions.add(session)
+            self._local.session = session
+        return session
+
+    def _send(self, method, path, base_url=None, **kwargs):
+        """Send a request, through the bulk operation's controller if any
+
+        path is relative to base_url, which defaults to the share API.
+        Returns the response, which hasn't been checked yet.
+        """
+        url = (base_url or self.api_url) + path
+        controller = getattr(self._local, 'controller', None)
+        if controller is None:
+            controller = self.controller
+        if controller is None:
+            return self.session.request(method, url, **kwargs)
+        import requests
+        attempt = 0
+        while True:
+            controller.acquire()
+            start = time.monotonic()
+            try:
+                request = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                controller.release(throttled=True)
+                status = None
+                delay = controller.retry_delay(method, attempt)
+                if delay is None:
+                    raise
+            except BaseException:
+                # Not retried, but the slot must still be given back
+                controller.release(throttled=True)
+                raise
+            else:
+                status = request.status_code
+                throttled = status == 429 or status >= 500
+                controller.release(time.monotonic() - start, throttled)
+                if not throttled:
+                    return request
+                delay = controller.retry_delay(
+                    method,
+                    attempt,
+                    status,
+                    request.headers.get('Retry-After')
+                )
+                if delay is None:
+                    return request
+                request.close()
+            if self.metrics is not None:
+                self.metrics.retried(operation_name(method, path), status)
+            time.sleep(delay)
+            attempt += 1
+
+    def _record(self, operation, start, response=None, received=None):
+        """Record a request started at start in metrics
+
+        Byte counts include the request line, status line and headers.
+        """
+        if self.metrics is None:
+            return
+        seconds = time.perf_counter() - start
+        if response is None:
+            self.metrics.request(operation, seconds)
+            return
+        request = response.request
+        sent = len(request.method) + len(request.url) + 12 + sum(
+            len(name) + len(value) + 4
+            for name, value in request.headers.items()
+        )
+        if request.body:
+            sent += len(request.body)
+        if received is not None:
+            received += len(response.reason or '') + 15 + sum(
+                len(name) + len(value) + 4
+                for name, value in response.headers.items()
+            )
+        self.metrics.request(
+            operation,
+            seconds,
+            response.status_code,
+            sent,
+            received
+        )
+
+    def run_bulk(self, function, items, controller=None):
+        """Call function(item) for every item concurrently
+
+        The requests made by function are paced and retried by a
+        ConcurrencyController, so the number in flight follows what the
+        server can take.
+
+        Keyword arguments:
+            function -- Called with each item, from a worker thread
+            items -- Iterable of items
+            controller -- The ConcurrencyController to use, defaults to
+                          the client's, or a new one growing up to the
+                          connection pool size
+
+        Returns a list in the same order as items, holding what function
+        returned, or the exception it raised.
+        """
+        if controller is None:
+            controller = self.controller
+        if controller is None:
+            controller = ConcurrencyController(maximum=self.pool_size)
+
+        def call(item):
+            self._local.controller = controller
+            try:
+                return function(item)
+            except Exception as e:
+                return e
+            finally:
+                self._local.controller = None
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(controller.maximum) as executor:
+            return list(executor.map(call, items))
+
+    def _request(self, method, path, **kwargs):
+        """Perform an OCS request and return the checked json feed"""
+        operation = operation_name(method, path)
+        start = time.perf_counter()
+        try:
+            request = self._send(method, path, **kwargs)
+            body = request.content
+        except Exception:
+            self._record(operation, start)
+            raise
+        self._record(operation, start, request, len(body))
+        check_request(request)
+        jsonfeed = self._decode(body)
+        self._check_status(operation, jsonfeed)
+        return jsonfeed
 
     def get_shares(self, path=None, reshares=None, subfiles=None):
         """Get a list of shares
@@ -101,25 +2226,317 @@ class OCShareAPI:
             subfiles -- returns all shares within a folder, given that
                         path defines a folder
         """
-        request = requests.get(
-            '%s%s/shares' % (self.url, API_PATH),
-            auth=(self.username, self.password),
-            params={
-                'format': 'json',
-                'path': path,
-                'reshares': reshares,
-                'subfiles': subfiles
-            },
-            verify=not self.disable_ssl_verification
+        if self.cache is not None:
+            shares = self.cache.get_shares(path, reshares, subfiles)
+            if shares is not None:
+                return shares
+        method, url_path, kwargs = self._get_shares_request(
+            path, reshares, subfiles
         )
-        check_request(request)
-        jsonfeed = request.json()
-        check_status(jsonfeed)
-        shares = []
-        for share in jsonfeed['ocs']['data']:
-            shares.append(OCShare(self, **share))
+        shares = self._get_shares_result(
+            self._request(method, url_path, **kwargs)
+        )
+        if self.cache is not None:
+            self.cache.put_shares(shares, path, reshares, subfiles)
         return shares
 
+    def iter_shares(self, path=None, reshares=None, subfiles=None,
+                    chunk_size=65536):
+        """Iterate over shares while the listing is being downloaded
+
+        Takes the same arguments as get_shares, but parses the response as
+        it streams in and yields each share as soon as it has been read, so
+        the whole listing is never held in memory. The cache isn't used.
+
+        Keyword arguments:
+            chunk_size -- Bytes read from the response at a time
+        """
+        for share in self.iter_share_data(
+                path, reshares, subfiles, chunk_size):
+            if self.metrics is None:
+                yield OCShare(self, **share)
+            else:
+                yield self._build_shares([share])[0]
+
+    def iter_share_data(self, path=None, reshares=None, subfiles=None,
+                        chunk_size=65536):
+        """Like iter_shares, but yields the raw share dicts"""
+        method, url_path, kwargs = self._get_shares_request(
+            path, reshares, subfiles
+        )
+        operation = operation_name(method, url_path)
+        start = time.perf_counter()
+        try:
+            request = self._send(method, url_path, stream=True, **kwargs)
+        except Exception:
+            self._record(operation, start)
+            raise
+        parser = OCSDataParser()
+        received = 0
+        try:
+            check_request(request)
+            for chunk in request.iter_content(chunk_size):
+                received += len(chunk)
+                if self.metrics is None:
+                    yield from parser.feed(chunk)
+                    continue
+                parsed = time.perf_counter()
+                shares = parser.feed(chunk)
+                self.metrics.decoded(time.perf_counter() - parsed, len(chunk))
+                yield from shares
+            yield from parser.close()
+        finally:
+            request.close()
+            # Timed until the listing has been consumed
+            self._record(operation, start, request, received)
+            if self.metrics is not None and parser.meta is not None:
+                self.metrics.ocs_status(operation, parser.meta['statuscode'])
+
+    def get_share_table(self, path=None, reshares=None, subfiles=None):
+        """Get a listing as a ShareTable, see get_shares"""
+        return ShareTable(
+            self,
+            self.iter_share_data(path, reshares, subfiles)
+        )
+
+    def iter_folder(self, path, depth=1, chunk_size=65536):
+        """List a folder's entries over WebDAV, parsed as they arrive
+
+        Yields (path, is_folder, shared) tuples, shared being whether the
+        entry has shares of its own, or None when the server doesn't say
+        (before ownCloud 9). With depth 'infinity' every entry under the
+        folder comes in one request, which servers may refuse with a 403.
+        """
+        from urllib.parse import quote, unquote
+        import xml.etree.ElementTree as ElementTree
+        operation = operation_name('PROPFIND', path)
+        start = time.perf_counter()
+        try:
+            response = self._send(
+                'PROPFIND',
+                quote(normalize_path(path).rstrip('/') + '/'),
+                base_url=self.url + WEBDAV_PATH,
+                data=PROPFIND_BODY,
+                headers={
+                    'Depth': str(depth),
+                    'Content-Type': 'application/xml'
+                },
+                stream=True
+            )
+        except Exception:
+            self._record(operation, start)
+            raise
+        folder = normalize_path(path)
+        parser = ElementTree.XMLPullParser()
+        received = 0
+        try:
+            if response.status_code != 207:
+                check_request(response)
+            for chunk in response.iter_content(chunk_size):
+                received += len(chunk)
+                parser.feed(chunk)
+                for event, item in parser.read_events():
+                    if item.tag != '{DAV:}response':
+                        continue
+                    entry = self._folder_entry(item, unquote)
+                    item.clear()
+                    if entry[0] != folder:
+                        yield entry
+            parser.close()
+        finally:
+            response.close()
+            self._record(operation, start, response, received)
+
+    @staticmethod
+    def _folder_entry(item, unquote):
+        """Return (path, is_folder, shared) for a PROPFIND response"""
+        href = unquote(item.findtext('{DAV:}href'))
+        entry = normalize_path(href.split(WEBDAV_PATH, 1)[-1])
+        is_folder = False
+        shared = None
+        for propstat in item.iter('{DAV:}propstat'):
+            if ' 200 ' not in (propstat.findtext('{DAV:}status') or ''):
+                continue
+            prop = propstat.find('{DAV:}prop')
+            collection = prop.find('{DAV:}resourcetype/{DAV:}collection')
+            if collection is not None:
+                is_folder = True
+            share_types = prop.find('{%s}share-types' % OWNCLOUD_NS)
+            if share_types is not None:
+                shared = len(share_types) > 0
+        return entry, is_folder, shared
+
+    def list_folder(self, path):
+        """List a folder's entries over WebDAV, see iter_folder"""
+        return list(self.iter_folder(path))
+
+    def _run_rounds(self, function, items, controller, retries):
+        """run_bulk, then run the items that failed again, up to retries
+        more times, raising the first error left"""
+        results = self.run_bulk(function, items, controller)
+        for attempt in range(retries):
+            failed = [
+                i for i, result in enumerate(results)
+                if isinstance(result, Exception)
+            ]
+            if not failed:
+                break
+            retried = self.run_bulk(
+                function,
+                [items[i] for i in failed],
+                controller
+            )
+            for i, result in zip(failed, retried):
+                results[i] = result
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def walk_folders(self, path='/', controller=None, retries=2,
+                     prune=True, limit=None):
+        """Find the folders whose entries have shares
+
+        Lists path and everything under it with one Depth: infinity
+        PROPFIND, streamed so only the folders are kept. Servers refusing
+        that are walked a level at a time instead, one PROPFIND per
+        folder with the listings of a level made concurrently, folders
+        that fail being retried up to retries more times; once more than
+        limit folders would have to be listed the walk stops and None is
+        returned. Returns the folders holding at least one shared entry,
+        the ones worth a get_shares(path=folder, subfiles=True) call.
+        When the server doesn't say which entries are shared, or prune is
+        false, every folder is returned.
+
+        The server only marks entries shared by this user, so shares
+        others made of this user's files don't keep a folder from being
+        pruned.
+        """
+        import requests
+        if controller is None:
+            controller = self.controller
+        if controller is None:
+            controller = ConcurrencyController(maximum=self.pool_size)
+        path = normalize_path(path)
+        try:
+            found = self._walk_infinite(path, controller, prune)
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code not in (
+                    400, 403, 405, 501):
+                raise
+            found = None
+        if found is not None:
+            return found
+        level = [path]
+        found = []
+        walked = 0
+        while level:
+            walked += len(level)
+            if limit is not None and walked > limit:
+                return None
+            listings = self._run_rounds(
+                self.list_folder, level, controller, retries
+            )
+            next_level = []
+            for folder, entries in zip(level, listings):
+                if not prune or any(
+                        shared is not False
+                        for entry, is_folder, shared in entries):
+                    found.append(folder)
+                next_level.extend(
+                    entry for entry, is_folder, shared in entries
+                    if is_folder
+                )
+            level = next_level
+        return found
+
+    def _walk_infinite(self, path, controller, prune):
+        """walk_folders with a single Depth: infinity PROPFIND
+
+        Returns None when the server answered with just the direct
+        entries, as servers not allowing infinite depth may do.
+        """
+        previous = getattr(self._local, 'controller', None)
+        self._local.controller = controller
+        try:
+            folders = OrderedDict([(path, not prune)])
+            deep = False
+            for entry, is_folder, shared in self.iter_folder(
+                    path, 'infinity'):
+                parent = entry.rsplit('/', 1)[0] or '/'
+                if parent != path:
+                    deep = True
+                if is_folder:
+                    folders.setdefault(entry, not prune)
+                if shared is not False:
+                    folders[parent] = True
+        finally:
+            self._local.controller = previous
+        if not deep and len(folders) > 1:
+            return None
+        return [folder for folder, wanted in folders.items() if wanted]
+
+    def get_shares_partitioned(self, reshares=None, folders=None,
+                               controller=None, retries=2,
+                               max_folders=1000):
+        """Get every share through many small listings
+
+        Instead of one get_shares() call, which makes the server build
+        one huge response, the shares of each folder's entries are listed
+        with get_shares(path=folder, subfiles=True) concurrently, and
+        merged by share id. As subfiles only covers a folder's direct
+        entries, the folders are found with walk_folders() unless given,
+        a single PROPFIND on servers allowing Depth: infinity. With
+        reshares, shares made by others can't be told apart over WebDAV,
+        so every folder is listed. Where that would take more than
+        max_folders listings, or the walk more than max_folders
+        PROPFINDs, the shares are listed with one get_shares() call after
+        all. Partitions
+        that fail (after the controller's own retries) are retried on
+        their own, up to retries more times.
+
+        Keyword arguments:
+            reshares -- See get_shares
+            folders -- The folders to list, defaults to walk_folders(),
+                       or every folder with reshares
+            controller -- ConcurrencyController pacing the requests
+            retries -- Extra rounds for the folders and partitions that
+                       failed
+            max_folders -- Most folders to walk or list one at a time,
+                           None for no limit
+
+        Raises the error of the first partition still failing after the
+        retries.
+        """
+        if controller is None:
+            controller = self.controller
+        if controller is None:
+            controller = ConcurrencyController(maximum=self.pool_size)
+        if folders is None:
+            folders = self.walk_folders(
+                '/', controller, retries, prune=not reshares,
+                limit=max_folders
+            )
+            if folders is None or (max_folders is not None and
+                                   len(folders) > max_folders):
+                return self.get_shares(reshares=reshares)
+
+        def listing(folder):
+            try:
+                return self.get_shares(folder, reshares, subfiles=True)
+            except OCShareException as e:
+                # 404 when nothing in the folder is shared
+                if e.status_code == 404:
+                    return []
+                raise
+
+        shares = OrderedDict()
+        for listed in self._run_rounds(
+                listing, list(folders), controller, retries):
+            for share in listed:
+                shares.setdefault(share.id, share)
+        return list(shares.values())
+
     def get_share_by_id(self, share_id):
         """Gets a share by ID
 
@@ -127,17 +2544,16 @@ class OCShareAPI:
             share_id -- The ID of the share
         """
 
-        request = requests.get(
-            '%s%s/shares/%d' % (self.url, API_PATH, share_id),
-            auth=(self.username, self.password),
-            params={'format': 'json'},
-            verify=not self.disable_ssl_verification
-        )
-        print('get_share_by_id: ', self.disable_ssl_verification)
-        check_request(request)
-        jsonfeed = request.json()
-        check_status(jsonfeed)
-        return OCShare(self, **jsonfeed['ocs']['data'][0])
+        if self.cache is not None:
+            share = self.cache.get_share(share_id)
+            if share is not None:
+                return share
+        method, path, kwargs = self._get_share_by_id_request(share_id)
+        jsonfeed = self._request(method, path, **kwargs)
+        share = self._get_share_by_id_result(jsonfeed)
+        if self.cache is not None:
+            self.cache.put_share(share)
+        return share
 
     def create_share(self, path, share_type, share_with=None,
                      public_upload=False, password=None, permissions=None):
@@ -156,25 +2572,67 @@ class OCShareAPI:
             password -- Password to protect public link share with
             permissions -- Bitwise permissions, use the PERMISSION_* constants
         """
-        request = requests.post(
-            '%s%s/shares' % (self.url, API_PATH),
-            allow_redirects=False,
-            auth=(self.username, self.password),
-            params={'format': 'json'},
-            data={
-                'path': path,
-                'shareType': share_type,
-                'shareWith': share_with,
-                'publicUpload': int(public_upload),
-                'password': password,
-                'permissions': permissions
-            },
-            verify=not self.disable_ssl_verification
+        method, path, kwargs = self._create_share_request(
+            path, share_type, share_with, public_upload, password, permissions
         )
-        check_request(request)
-        jsonfeed = request.json()
-        check_status(jsonfeed)
-        return self.get_share_by_id(jsonfeed['ocs']['data']['id'])
+        jsonfeed = self._request(method, path, **kwargs)
+        share = self._create_share_result(jsonfeed)
+        if share is None:
+            share = self.get_share_by_id(jsonfeed['ocs']['data']['id'])
+        self._share_created(share)
+        return share
+
+    def update_queue(self, delay=0.5, callback=None):
+        """Return a ShareUpdateQueue sending updates through this client"""
+        return ShareUpdateQueue(self, delay, callback)
+
+    def create_shares(self, specs, max_workers=None, controller=None):
+        """Create many shares concurrently, see run_bulk
+
+        Keyword arguments:
+            specs -- Iterable of dicts of create_share keyword arguments
+            max_workers -- Most creates in flight at once, shorthand for
+                           a controller capped at that many
+            controller -- ConcurrencyController pacing the creates
+
+        Returns a list in the same order as specs, holding the created
+        OCShare, or the exception raised while creating that share.
+        """
+        if controller is None and max_workers is not None:
+            controller = ConcurrencyController(
+                initial=max_workers,
+                maximum=max_workers
+            )
+        return self.run_bulk(
+            lambda spec: self.create_share(**spec),
+            specs,
+            controller
+        )
+
+    def update_shares(self, updates, controller=None):
+        """Update many shares concurrently, see run_bulk
+
+        Keyword arguments:
+            updates -- Iterable of dicts of update_share_by_id keyword
+                       arguments, including share_id
+            controller -- ConcurrencyController pacing the updates
+
+        Returns a list in the same order as updates, holding None, or the
+        exception raised while updating that share.
+        """
+        return self.run_bulk(
+            lambda update: self.update_share_by_id(**update),
+            updates,
+            controller
+        )
+
+    def delete_shares(self, share_ids, controller=None):
+        """Delete many shares by ID concurrently, see run_bulk
+
+        Returns a list in the same order as share_ids, holding None, or
+        the exception raised while deleting that share.
+        """
+        return self.run_bulk(self.delete_share_by_id, share_ids, controller)
 
     def delete_share(self, share):
         """Delete a share"""
@@ -183,15 +2641,9 @@ class OCShareAPI:
     def delete_share_by_id(self, share_id):
         """Delete a share by ID"""
 
-        request = requests.delete(
-            '%s%s/shares/%d' % (self.url, API_PATH, share_id),
-            auth=(self.username, self.password),
-            params={'format': 'json'},
-            verify=not self.disable_ssl_verification
-        )
-        check_request(request)
-        jsonfeed = request.json()
-        check_status(jsonfeed)
+        method, path, kwargs = self._delete_share_by_id_request(share_id)
+        self._request(method, path, **kwargs)
+        self._share_deleted(share_id)
 
     def update_share(self, share, permissions=None,
                      password=None, public_upload=None, expire_date=None):
@@ -212,7 +2664,7 @@ class OCShareAPI:
             permissions,
             password,
             public_upload,
-            expireDate=expire_date
+            expire_date=expire_date
         )
 
     def update_share_by_id(self, share_id, permissions=None,
@@ -229,28 +2681,141 @@ class OCShareAPI:
                             (True/False)
             expire_date -- Expiry date, a python datetime object.
         """
-        if expire_date:
-            expire_date = expire_date.strftime('%d-%m-%Y')
-        elif expire_date is False:
-            expire_date = ''
+        method, path, kwargs = self._update_share_by_id_request(
+            share_id, permissions, password, public_upload, expire_date
+        )
+        with self._updating(share_id, update_changes(
+                permissions, password, public_upload, expire_date)):
+            self._request(method, path, **kwargs)
 
-        if password is False:
-            password = ''
-        request = requests.put(
-            '%s%s/shares/%d' % (self.url, API_PATH, share_id),
-            auth=(self.username, self.password),
-            params={'format': 'json'},
-            data={
-                'permissions': permissions,
-                'password': password,
-                'publicUpload': public_upload,
-                'expireDate': expire_date
-            },
-            verify=not self.disable_ssl_verification
+
+class OCShareFleet:
+    """Runs the same calls on many accounts of many servers concurrently
+
+    Every account gets its own OCShareAPI, and the accounts of a server
+    share one ConcurrencyController, so the requests in flight to a
+    server stay within its limit however many of its accounts are busy,
+    while servers are worked on in parallel. Results are keyed by
+    account name.
+
+    Keyword arguments:
+        accounts -- Iterable of (name, options) pairs, options being a
+                    dict with url, username, password and optionally
+                    disable_ssl_verification and max_concurrency (the
+                    most requests in flight to that server, default 10,
+                    the lowest given by its accounts wins)
+        metrics -- A Metrics every client records requests in
+    """
+
+    def __init__(self, accounts, metrics=None):
+        accounts = OrderedDict(accounts)
+        limits = {}
+        for options in accounts.values():
+            url = options['url'].rstrip('/')
+            limit = int(options.get('max_concurrency', 10))
+            limits[url] = min(limit, limits.get(url, limit))
+        self.controllers = dict(
+            (url, ConcurrencyController(maximum=limit))
+            for url, limit in limits.items()
+        )
+        self.clients = OrderedDict()
+        for name, options in accounts.items():
+            url = options['url'].rstrip('/')
+            self.clients[name] = OCShareAPI(
+                options['url'],
+                options['username'],
+                options['password'],
+                options.get('disable_ssl_verification', False),
+                pool_size=limits[url],
+                controller=self.controllers[url],
+                metrics=metrics
+            )
+
+    @classmethod
+    def load(cls, fp, names=None, metrics=None):
+        """Read accounts from an INI file object, a section per account
+
+            [work]
+            url = https://example.com/owncloud
+            username = bob
+            password = secret
+            disable_ssl_verification = no
+            max_concurrency = 10
+
+        Keyword arguments:
+            fp -- The credentials file
+            names -- Only load these accounts, in this order
+            metrics -- See OCShareFleet
+
+        Raises ValueError for an unreadable file or missing account.
+        """
+        import configparser
+        config = configparser.ConfigParser(interpolation=None)
+        try:
+            config.read_file(fp)
+        except configparser.Error as e:
+            raise ValueError(str(e))
+        if names is None:
+            names = config.sections()
+        accounts = []
+        for name in names:
+            if not config.has_section(name):
+                raise ValueError('no account %r' % name)
+            section = config[name]
+            for option in ('url', 'username', 'password'):
+                if option not in section:
+                    raise ValueError('account %r has no %s' % (name, option))
+            options = dict(section)
+            options['disable_ssl_verification'] = section.getboolean(
+                'disable_ssl_verification',
+                False
+            )
+            options['max_concurrency'] = section.getint('max_concurrency', 10)
+            accounts.append((name, options))
+        return cls(accounts, metrics)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close every client's connections"""
+        for ocs in self.clients.values():
+            ocs.close()
+
+    def map(self, function, names=None):
+        """Call function(ocshareapi) for every account concurrently
+
+        Keyword arguments:
+            function -- Called with each account's OCShareAPI, from a
+                        worker thread
+            names -- Only these accounts (default all)
+
+        Returns an OrderedDict of account name to what function returned,
+        or the exception it raised.
+        """
+        if names is None:
+            names = list(self.clients)
+        if not names:
+            return OrderedDict()
+
+        def call(name):
+            try:
+                return function(self.clients[name])
+            except Exception as e:
+                return e
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(len(names)) as executor:
+            return OrderedDict(zip(names, executor.map(call, names)))
+
+    def get_shares(self, path=None, reshares=None, subfiles=None):
+        """Get every account's shares, see OCShareAPI.get_shares and map"""
+        return self.map(
+            lambda ocs: ocs.get_shares(path, reshares, subfiles)
         )
-        check_request(request)
-        jsonfeed = request.json()
-        check_status(jsonfeed)
 
 
 class OCShare:
@@ -264,7 +2829,7 @@ class OCShare:
             self.url = None
 
     def delete(self):
-        self.ocshareapi.delete_share_by_id(self.id)
+        return self.ocshareapi.delete_share_by_id(self.id)
 
     def update(self, permissions=None,
                password=None, public_upload=None, expire_date=None):
@@ -278,6 +2843,12 @@ class OCShare:
             expire_date
         )
 
+    def to_dict(self):
+        """Return the share's fields as a dict"""
+        return dict(
+            (k, v) for k, v in vars(self).items() if k != 'ocshareapi'
+        )
+
     def __str__(self):
         return '<OCShare #%d>' % (self.id)
 
@@ -0,0 +1,233 @@
+import time
+import asyncio
+import aiohttp
+import requests
+from ocsharetools import *
+
+
+class AsyncResponse:
+    """Adapts an aiohttp response to what check_request expects"""
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status
+        self.reason = response.reason
+        self.url = str(response.url)
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 500:
+            kind = 'Client'
+        elif 500 <= self.status_code < 600:
+            kind = 'Server'
+        else:
+            return
+        raise requests.exceptions.HTTPError(
+            '%s %s Error: %s for url: %s' % (
+                self.status_code, kind, self.reason, self.url
+            )
+        )
+
+
+class AsyncOCShareAPI(OCShareAPIBase):
+    def __init__(self, url, username, password, disable_ssl_verification=False,
+                 max_concurrency=10, cache=None, metrics=None):
+        """Initialise the asyncio API client
+
+        Takes the same arguments as OCShareAPI, with max_concurrency
+        capping the number of requests this client has in flight at once.
+        The client must be used from a running event loop, and closed
+        with close() (or used as an async context manager) when done.
+        """
+        super().__init__(
+            url, username, password, disable_ssl_verification, cache, metrics
+        )
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Close all pooled connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                auth=aiohttp.BasicAuth(self.username, self.password),
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_concurrency,
+                    ssl=False if self.disable_ssl_verification else None
+                )
+            )
+        return self._session
+
+    def _record(self, operation, start, status=None, received=None):
+        """Record a request started at start in metrics"""
+        if self.metrics is not None:
+            self.metrics.request(
+                operation,
+                time.perf_counter() - start,
+                status,
+                received=received
+            )
+
+    async def _request(self, method, path, **kwargs):
+        """Perform an OCS request and return the checked json feed"""
+        operation = operation_name(method, path)
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                async with self.session.request(
+                    method,
+                    self.api_url + path,
+                    **kwargs
+                ) as response:
+                    body = await response.read()
+            except Exception:
+                self._record(operation, start)
+                raise
+        self._record(operation, start, response.status, len(body))
+        check_request(AsyncResponse(response))
+        jsonfeed = self._decode(body)
+        self._check_status(operation, jsonfeed)
+        return jsonfeed
+
+    async def get_shares(self, path=None, reshares=None, subfiles=None):
+        """Get a list of shares, see OCShareAPI.get_shares"""
+        if self.cache is not None:
+            shares = self.cache.get_shares(path, reshares, subfiles)
+            if shares is not None:
+                return shares
+        method, url_path, kwargs = self._get_shares_request(
+            path, reshares, subfiles
+        )
+        jsonfeed = await self._request(method, url_path, **kwargs)
+        shares = self._get_shares_result(jsonfeed)
+        if self.cache is not None:
+            self.cache.put_shares(shares, path, reshares, subfiles)
+        return shares
+
+    async def iter_shares(self, path=None, reshares=None, subfiles=None,
+                          chunk_size=65536):
+        """Iterate over shares while the listing is being downloaded,
+        see OCShareAPI.iter_shares"""
+        method, url_path, kwargs = self._get_shares_request(
+            path, reshares, subfiles
+        )
+        operation = operation_name(method, url_path)
+        parser = OCSDataParser()
+        received = 0
+        status = None
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                async with self.session.request(
+                    method,
+                    self.api_url + url_path,
+                    **kwargs
+                ) as response:
+                    status = response.status
+                    check_request(AsyncResponse(response))
+                    chunks = response.content.iter_chunked(chunk_size)
+                    async for chunk in chunks:
+                        received += len(chunk)
+                        parsed = time.perf_counter()
+                        shares = parser.feed(chunk)
+                        if self.metrics is not None:
+                            self.metrics.decoded(
+                                time.perf_counter() - parsed,
+                                len(chunk)
+                            )
+                        for share in self._build_shares(shares):
+                            yield share
+                    for share in self._build_shares(parser.close()):
+                        yield share
+            finally:
+                self._record(operation, start, status, received)
+                if self.metrics is not None and parser.meta is not None:
+                    self.metrics.ocs_status(
+                        operation,
+                        parser.meta['statuscode']
+                    )
+
+    async def get_share_by_id(self, share_id):
+        """Gets a share by ID, see OCShareAPI.get_share_by_id"""
+        if self.cache is not None:
+            share = self.cache.get_share(share_id)
+            if share is not None:
+                return share
+        method, path, kwargs = self._get_share_by_id_request(share_id)
+        jsonfeed = await self._request(method, path, **kwargs)
+        share = self._get_share_by_id_result(jsonfeed)
+        if self.cache is not None:
+            self.cache.put_share(share)
+        return share
+
+    async def create_share(self, path, share_type, share_with=None,
+                           public_upload=False, password=None,
+                           permissions=None):
+        """Create a share, see OCShareAPI.create_share"""
+        method, path, kwargs = self._create_share_request(
+            path, share_type, share_with, public_upload, password, permissions
+        )
+        jsonfeed = await self._request(method, path, **kwargs)
+        share = self._create_share_result(jsonfeed)
+        if share is None:
+            share = await self.get_share_by_id(jsonfeed['ocs']['data']['id'])
+        self._share_created(share)
+        return share
+
+    async def create_shares(self, specs):
+        """Create many shares concurrently, see OCShareAPI.create_shares
+
+        Concurrency is bounded by max_concurrency. A spec with bad
+        arguments gets its TypeError in place, like any other failure.
+        """
+        async def create(spec):
+            try:
+                return await self.create_share(**spec)
+            except Exception as e:
+                return e
+
+        return await asyncio.gather(*[create(spec) for spec in specs])
+
+    async def delete_share(self, share):
+        """Delete a share"""
+        return await self.delete_share_by_id(share.id)
+
+    async def delete_share_by_id(self, share_id):
+        """Delete a share by ID"""
+        method, path, kwargs = self._delete_share_by_id_request(share_id)
+        await self._request(method, path, **kwargs)
+        self._share_deleted(share_id)
+
+    async def update_share(self, share, permissions=None,
+                           password=None, public_upload=None,
+                           expire_date=None):
+        """Update a share, see OCShareAPI.update_share"""
+        return await self.update_share_by_id(
+            share.id,
+            permissions,
+            password,
+            public_upload,
+            expire_date=expire_date
+        )
+
+    async def update_share_by_id(self, share_id, permissions=None,
+                                 password=None, public_upload=None,
+                                 expire_date=None):
+        """Update a share by ID, see OCShareAPI.update_share_by_id"""
+        method, path, kwargs = self._update_share_by_id_request(
+            share_id, permissions, password, public_upload, expire_date
+        )
+        with self._updating(share_id, update_changes(
+                permissions, password, public_upload, expire_date)):
+            await self._request(method, path, **kwargs)
@@ -1,7 +1,10 @@
 from ocsharetools import *
 import argparse
-import path
-from datetime import datetime
+import json
+import sys
+import time
+import threading
+import collections
 
 
 def defaultPermissions(share_type):
@@ -82,7 +85,7 @@ def add_permission_flags(parser):
         '--deny-delete',
         action='append_const',
         const=8,
-        dest='permissions',
+        dest='permissions_deny',
         help='deny delete access'
     )
     parser.add_argument(
@@ -94,19 +97,65 @@ def add_permission_flags(parser):
     )
 
 
-def run():
+OUTPUT_FORMATS = ('text', 'json', 'ndjson', 'csv', 'tsv')
+
+# Columns written by the csv and tsv formats when --fields isn't given
+TABLE_FIELDS = (
+    'id', 'share_type', 'share_with', 'path', 'item_type', 'permissions',
+    'stime', 'expiration', 'token', 'url'
+)
+
+
+def parse_fields(value):
+    """argparse type for comma separated field names"""
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if not fields:
+        raise argparse.ArgumentTypeError('no fields given')
+    return fields
+
+
+def add_output_flags(parser):
+    parser.add_argument(
+        '--format',
+        choices=OUTPUT_FORMATS,
+        default='text',
+        help='output format, shares are written as they are read '
+             '(default %(default)s)'
+    )
+    parser.add_argument(
+        '--fields',
+        type=parse_fields,
+        help='comma separated share fields to output, eg id,path,url '
+             '(default all fields for json and ndjson, %s for csv and '
+             'tsv)' % ','.join(TABLE_FIELDS)
+    )
+
+
+def parse_date(value):
+    """argparse type for DD-MM-YYYY dates"""
+    from datetime import datetime
+    try:
+        return datetime.strptime(value, "%d-%m-%Y")
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            '%r is not a DD-MM-YYYY date' % value
+        )
+
+
+def make_parser():
+    """Build the argument parser, returns it and its subparsers by name"""
     parser = argparse.ArgumentParser(description='Perform OCS Share API calls')
     parser.add_argument('--username',
                         dest='username',
-                        required=True,
+                        required=False,
                         help='Your OwnCloud username')
     parser.add_argument('--password',
                         dest='password',
-                        required=True,
+                        required=False,
                         help='Your OwnCloud password')
     parser.add_argument('--url',
                         dest='url',
-                        required=True,
+                        required=False,
                         help='Your OwnCloud url, eg '
                              'https://example.com/owncloud/')
     parser.add_argument('--disable-ssl-verification',
@@ -115,6 +164,28 @@ def run():
                         help='Disables SSL verification, eg '
                         'when the OwnCloud server is using '
                         'self-signed certificates')
+    parser.add_argument('--accounts',
+                        type=argparse.FileType('r'),
+                        required=False,
+                        help='Run getshares, getshare or bulk on every '
+                        'account of this credentials file at once, instead '
+                        'of --username, --password and --url')
+    parser.add_argument('--account',
+                        action='append',
+                        dest='account_names',
+                        metavar='NAME',
+                        help='Only use this account of --accounts, may be '
+                        'given more than once')
+    parser.add_argument('--no-daemon',
+                        action='store_true',
+                        required=False,
+                        help='Run the command in this process even when '
+                        'ocsharetools-daemon is running')
+    parser.add_argument('--stats',
+                        action='store_true',
+                        required=False,
+                        help='Print request counts, timings and sizes to '
+                        'stderr when done, implies --no-daemon')
 
     subparsers = parser.add_subparsers(
         help='Available commands',
@@ -150,12 +221,22 @@ def run():
         help='returns all shares within a folder, '
              'given that path defines a folder'
     )
+    parser_get_shares.add_argument(
+        '--partitioned',
+        action='store_true',
+        help='without --path, list all shares with a request per folder '
+             'holding shares, made concurrently, instead of one large '
+             'request; folders are found over WebDAV, and with '
+             '--enable-reshares every folder is listed'
+    )
+    add_output_flags(parser_get_shares)
 
     parser_get_share = subparsers.add_parser(
         'getshare',
         help='get a single share by id'
     )
     parser_get_share.add_argument('id', type=int, help='share id')
+    add_output_flags(parser_get_share)
 
     parser_create = subparsers.add_parser('create', help='create a share')
     parser_create.add_argument(
@@ -192,7 +273,30 @@ def run():
         type=str,
         help='password to protect public link Share with'
     )
+    parser_create.add_argument(
+        '--recursive',
+        action='store_true',
+        help='share the local folder --path and everything in it the same '
+             'way, skipping what is already shared'
+    )
+    parser_create.add_argument(
+        '--max-depth',
+        type=int,
+        help='with --recursive, levels below --path to share'
+    )
+    parser_create.add_argument(
+        '--concurrency',
+        type=int,
+        default=10,
+        help='with --recursive, most requests to make at once (default 10)'
+    )
+    parser_create.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='with --recursive, only print the shares that would be created'
+    )
     add_permission_flags(parser_create)
+    add_output_flags(parser_create)
 
     parser_update = subparsers.add_parser('update', help='update a share')
     parser_update.add_argument('id', type=int, help='share id')
@@ -228,84 +332,843 @@ def run():
     )
     parser_delete.add_argument('id', type=int, help='share id to delete')
 
-    parser_delete = subparsers.add_parser('gui', help='run gui')
-    parser_delete.add_argument(
+    parser_gui = subparsers.add_parser('gui', help='run gui')
+    parser_gui.add_argument(
         '--path',
         type=str,
+        nargs='+',
         required=True,
-        help='path to the file/folder which should be shared'
+        help='paths to the files/folders which should be shared'
     )
-    parser_delete.add_argument(
+    parser_gui.add_argument(
         '--instant-upload-path',
         type=str,
         required=False,
         help='path to do instant uploads to, if required'
     )
 
-    args = parser.parse_args()
-    ocs = OCShareAPI(args.url, args.username, args.password, args.disable_ssl_verification)
-    if args.subparser_name == "gui":
-        import ocsharetools_gui
-        ocsharetools_gui.run(args)
-    try:
-        if hasattr(args,"ocroot"):
-            if (args.ocroot is not None) and (len(args.ocroot)>0):
-                ocpath=os.path.realpath(args.path)
-                if ocpath.find(args.ocroot)==0:
-                    ocpath=ocpath[len(args.ocroot):]
+    parser_batch = subparsers.add_parser(
+        'batch',
+        help='run getshares/getshare/create/update/delete operations '
+             'read as JSON lines'
+    )
+    parser_batch.add_argument(
+        'file',
+        nargs='?',
+        type=argparse.FileType('r'),
+        default=sys.stdin,
+        help='file to read operations from (default stdin)'
+    )
+    parser_batch.add_argument(
+        '--concurrency',
+        type=int,
+        default=1,
+        help='most operations to run at once, fewer while the server '
+             'is throttling or slowing down (default 1)'
+    )
+
+    parser_apply = subparsers.add_parser(
+        'apply',
+        help='create, update and delete shares to match a JSON manifest'
+    )
+    parser_apply.add_argument(
+        'manifest',
+        type=argparse.FileType('r'),
+        help='manifest of the shares to have, see README'
+    )
+    parser_apply.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='only print the changes that would be made'
+    )
+    parser_apply.add_argument(
+        '--concurrency',
+        type=int,
+        default=10,
+        help='most changes to make at once, fewer while the server '
+             'is throttling or slowing down (default 10)'
+    )
+
+    parser_bulk = subparsers.add_parser(
+        'bulk',
+        help='list, update or delete every share matching filters'
+    )
+    parser_bulk.add_argument(
+        'action',
+        choices=['list', 'update', 'delete'],
+        help='what to do with the matching shares'
+    )
+    parser_bulk.add_argument(
+        '--share-type',
+        type=int,
+        action='append',
+        help='match shares of this type, may be repeated'
+    )
+    parser_bulk.add_argument(
+        '--with-permissions',
+        type=int,
+        help='match shares having all these permission bits'
+    )
+    parser_bulk.add_argument(
+        '--without-permissions',
+        type=int,
+        help='match shares having none of these permission bits'
+    )
+    parser_bulk.add_argument(
+        '--path',
+        type=str,
+        help='match shares of this path and everything below it'
+    )
+    parser_bulk.add_argument(
+        '--share-with',
+        type=str,
+        action='append',
+        help='match shares with this user or group, may be repeated'
+    )
+    parser_bulk.add_argument(
+        '--expires-after',
+        type=parse_date,
+        help='match shares expiring on or after this DD-MM-YYYY date'
+    )
+    parser_bulk.add_argument(
+        '--expires-before',
+        type=parse_date,
+        help='match shares expiring before this DD-MM-YYYY date'
+    )
+    parser_bulk.add_argument(
+        '--no-expiration',
+        action='store_true',
+        help='match shares without an expiry date'
+    )
+    parser_bulk.add_argument(
+        '--duplicates',
+        action='store_true',
+        help='match all but the oldest share of the same path and user, '
+             'group or public link'
+    )
+    parser_bulk.add_argument(
+        '--share-password',
+        type=str,
+        help='update: password to protect public links with'
+    )
+    parser_bulk.add_argument(
+        '--expire-date',
+        type=parse_date,
+        help='update: expiry date, in DD-MM-YYYY format'
+    )
+    parser_bulk.add_argument(
+        '--disable-expire-date',
+        action='store_true',
+        help='update: disable the expiry date'
+    )
+    parser_bulk.add_argument(
+        '--all',
+        action='store_true',
+        help='update or delete every share when no filter is given'
+    )
+    add_permission_flags(parser_bulk)
+    parser_bulk.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='only print the changes that would be made'
+    )
+    parser_bulk.add_argument(
+        '--concurrency',
+        type=int,
+        default=10,
+        help='most changes to make at once, fewer while the server '
+             'is throttling or slowing down (default 10)'
+    )
+
+    parser_snapshot = subparsers.add_parser(
+        'snapshot',
+        help='save all shares to a local database and print what changed '
+             'since the last snapshot as JSON lines'
+    )
+    parser_snapshot.add_argument(
+        '--db',
+        required=True,
+        help='SQLite database to keep snapshots in, created if needed'
+    )
+
+    parser_changes = subparsers.add_parser(
+        'changes',
+        help="print the changes recorded by this account's snapshots as "
+             "JSON lines"
+    )
+    parser_changes.add_argument(
+        '--db',
+        required=True,
+        help='SQLite database the snapshots were saved to'
+    )
+    parser_changes.add_argument(
+        '--since',
+        type=int,
+        help='only changes of snapshots taken after this snapshot id'
+    )
+
+    return parser, subparsers.choices
+
+
+def get_ocpath(args):
+    """Return the cloud path for args.path, stripping args.ocroot"""
+    if getattr(args, 'ocroot', None):
+        ocpath = os.path.realpath(args.path)
+        if ocpath.find(args.ocroot) == 0:
+            ocpath = ocpath[len(args.ocroot):]
+        return ocpath
+    return getattr(args, 'path', None)
+
+
+def execute(ocs, args):
+    """Run a getshares/getshare/create/update/delete command
+
+    Returns the list of shares, the share, or None for delete and update.
+    """
+    if args.subparser_name == "getshares":
+        if getattr(args, 'partitioned', False) and not args.path:
+            shares = ocs.get_shares_partitioned(reshares=args.enable_reshares)
+            return sorted(shares, key=lambda share: share.id)
+        return ocs.get_shares(
+            path=get_ocpath(args),
+            reshares=args.enable_reshares,
+            subfiles=args.enable_subfiles
+        )
+    elif args.subparser_name == "getshare":
+        return ocs.get_share_by_id(share_id=args.id)
+    elif args.subparser_name == "create":
+        if getattr(args, 'recursive', False):
+            raise ValueError('recursive create only runs on its own')
+        return ocs.create_share(
+            path=get_ocpath(args),
+            share_type=args.share_type,
+            share_with=args.share_with,
+            public_upload=args.public_upload,
+            password=args.share_password,
+            permissions=calcPermissions(
+                args.permissions_allow,
+                args.permissions_deny,
+                defaultPermissions(args.share_type)
+            )
+        )
+    elif args.subparser_name == "delete":
+        ocs.delete_share_by_id(args.id)
+    elif args.subparser_name == "update":
+        if args.permissions_allow or args.permissions_deny:
+            share = ocs.get_share_by_id(args.id)
+            permissions = calcPermissions(
+                args.permissions_allow,
+                args.permissions_deny,
+                share.permissions
+            )
+        else:
+            permissions = None
+
+        if args.disable_expire_date:
+            expire_date = False
+        elif args.expire_date:
+            from datetime import datetime
+            expire_date = datetime.strptime(args.expire_date, "%d-%m-%Y")
+        else:
+            expire_date = None
+
+        ocs.update_share_by_id(
+            share_id=args.id,
+            permissions=permissions,
+            password=args.share_password,
+            public_upload=args.public_upload,
+            expire_date=expire_date
+        )
+
+
+def print_result(result, out=None):
+    if result is None:
+        return
+    if isinstance(result, OCShare):
+        result = [result]
+    for share in result:
+        print("#%d %s %s" % (share.id, share.url, share.path), file=out)
+
+
+class ShareWriter:
+    """Writes shares to out one at a time, in one of OUTPUT_FORMATS
+
+    Nothing is kept of the shares written, so listings of any size are
+    written in constant memory. Shares may be written from several
+    threads. Call close() after the last share, which ends the json
+    array.
+
+    Keyword arguments:
+        out -- File object to write to
+        format -- One of OUTPUT_FORMATS (default 'text', the id, url and
+                  path of each share)
+        fields -- Names of the share fields to write, shares without a
+                  field get null (or an empty cell). By default json and
+                  ndjson write every field, csv and tsv TABLE_FIELDS
+    """
+
+    def __init__(self, out, format='text', fields=None):
+        if format not in OUTPUT_FORMATS:
+            raise ValueError('unknown format %r' % format)
+        if fields is None and format in ('csv', 'tsv'):
+            fields = TABLE_FIELDS
+        self.out = out
+        self.format = format
+        self.fields = fields
+        self.count = 0
+        self._lock = threading.Lock()
+        self._csv = None
+        if format in ('csv', 'tsv'):
+            import csv
+            self._csv = csv.writer(
+                out,
+                delimiter=',' if format == 'csv' else '\t',
+                lineterminator='\n'
+            )
+
+    def _start(self):
+        """Write what comes before the first share"""
+        if self.format == 'json':
+            self.out.write('[')
+        elif self._csv is not None:
+            self._csv.writerow(self.fields)
+
+    def write(self, share):
+        """Write a share, an OCShare or a share dict with its url"""
+        if not isinstance(share, dict):
+            share = share.to_dict()
+        if self.fields is not None:
+            share = collections.OrderedDict(
+                (field, share.get(field)) for field in self.fields
+            )
+        if self.format == 'text':
+            if self.fields is None:
+                line = "#%d %s %s" % (share['id'], share['url'], share['path'])
+            else:
+                line = ' '.join(str(value) for value in share.values())
+        elif self._csv is None:
+            line = json.dumps(share)
+        else:
+            row = [
+                '' if value is None else
+                json.dumps(value) if isinstance(value, (dict, list)) else
+                value
+                for value in share.values()
+            ]
+        with self._lock:
+            if not self.count:
+                self._start()
+            self.count += 1
+            if self._csv is not None:
+                self._csv.writerow(row)
+            elif self.format == 'json':
+                self.out.write(('\n' if self.count == 1 else ',\n') + line)
             else:
-                ocpath=args.path
-        if args.subparser_name == "getshares":
-            shares = ocs.get_shares(
-                path=ocpath,
+                self.out.write(line + '\n')
+
+    def close(self):
+        """Finish the output, eg end the json array"""
+        with self._lock:
+            if not self.count:
+                self._start()
+            if self.format == 'json':
+                self.out.write('\n]\n' if self.count else ']\n')
+            self.out.flush()
+
+
+def share_records(ocs, shares, source=None):
+    """Yield share dicts with their url for ShareWriter
+
+    Keyword arguments:
+        ocs -- The OCShareAPI the shares come from
+        shares -- Iterable of share dicts, eg ocs.iter_share_data(), or
+                  of OCShares
+        source -- Account name, added as the source field when given
+    """
+    for share in shares:
+        if isinstance(share, dict):
+            share = dict(share)
+            token = share.get('token')
+            share['url'] = ocs.url + SHARE_PATH + token if token else None
+        else:
+            share = share.to_dict()
+        if source is not None:
+            share['source'] = source
+        yield share
+
+
+def streams(ocs, args):
+    """Return whether a getshares can be written as it downloads"""
+    return (
+        args.subparser_name == "getshares" and ocs.cache is None and
+        not (getattr(args, 'partitioned', False) and not args.path)
+    )
+
+
+def run_command(ocs, args, out=None, err=None, writer=None, source=None):
+    """Execute a command and write its result to out
+
+    Shares are written through writer, by default a ShareWriter in the
+    command's --format. OCS errors go to out in the text format, and to
+    err (default stderr) otherwise.
+
+    Keyword arguments:
+        writer -- A ShareWriter to write to, which is left open
+        source -- Account name to add to the shares, see share_records
+    """
+    if out is None:
+        out = sys.stdout
+    close = writer is None
+    if writer is None:
+        writer = ShareWriter(
+            out,
+            getattr(args, 'format', 'text'),
+            getattr(args, 'fields', None)
+        )
+    try:
+        if streams(ocs, args):
+            result = ocs.iter_share_data(
+                path=get_ocpath(args),
                 reshares=args.enable_reshares,
                 subfiles=args.enable_subfiles
             )
-            for share in shares:
-                print("#%d %s %s" % (share.id, share.url, share.path))
-        elif args.subparser_name == "getshare":
-            share = ocs.get_share_by_id(share_id=args.id)
-            print("#%d %s %s" % (share.id, share.url, share.path))
-        elif args.subparser_name == "create":
-            share = ocs.create_share(
-                path=ocpath,
-                share_type=args.share_type,
-                share_with=args.share_with,
-                public_upload=args.public_upload,
-                password=args.share_password,
-                permissions=calcPermissions(
-                    args.permissions_allow,
-                    args.permissions_deny,
-                    defaultPermissions(args.share_type)
-                )
-            )
-            print("#%d %s %s" % (share.id, share.url, share.path))
-        elif args.subparser_name == "delete":
-            ocs.delete_share_by_id(args.id)
-        elif args.subparser_name == "update":
-            if args.permissions_allow or args.permissions_deny:
-                share = ocs.get_share_by_id(args.id)
-                permissions = calcPermissions(
-                    args.permissions_allow,
-                    args.permissions_deny,
-                    share.permissions
-                )
+        else:
+            result = execute(ocs, args)
+            if result is None:
+                return
+            if isinstance(result, OCShare):
+                result = [result]
+        for share in share_records(ocs, result, source):
+            writer.write(share)
+    except OCShareException as e:
+        print(e, file=out if writer.format == 'text' else err or sys.stderr)
+        return
+    if close:
+        writer.close()
+
+
+BATCH_COMMANDS = ('getshares', 'getshare', 'create', 'update', 'delete')
+
+
+def batch_args(subparsers, operation):
+    """Turn a batch operation into the arguments of its subcommand
+
+    operation is a dict with the subcommand under 'op' and the
+    subcommand's arguments under their argparse dest names, eg
+    {"op": "create", "path": "/a", "share_type": 3}.
+    """
+    operation = dict(operation)
+    name = operation.pop('op', None)
+    if name not in BATCH_COMMANDS:
+        raise ValueError('unknown op %r' % name)
+    args = argparse.Namespace(subparser_name=name)
+    for action in subparsers[name]._actions:
+        if action.dest == 'help' or hasattr(args, action.dest):
+            continue
+        if action.dest in operation:
+            setattr(args, action.dest, operation.pop(action.dest))
+        elif action.required or not action.option_strings:
+            raise ValueError('%s needs %s' % (name, action.dest))
+        else:
+            setattr(args, action.dest, action.default)
+    if operation:
+        raise ValueError('unknown fields %s' % ', '.join(sorted(operation)))
+    return args
+
+
+def run_batch(ocs, subparsers, lines, out, concurrency=1):
+    """Run operations read as JSON lines, writing a JSON result per line
+
+    Each operation may carry a "ref", which is copied to its result to
+    correlate the two, it defaults to the line number. Results are
+    written in input order as {"ref": ..., "ok": true, "result": ...} or
+    {"ref": ..., "ok": false, "error": "..."}.
+    """
+    def perform(item):
+        number, line = item
+        ref = number
+        try:
+            operation = json.loads(line)
+            ref = operation.pop('ref', number)
+            result = execute(ocs, batch_args(subparsers, operation))
+        except Exception as e:
+            return {'ref': ref, 'ok': False, 'error': str(e)}
+        if isinstance(result, OCShare):
+            result = result.to_dict()
+        elif result is not None:
+            result = [share.to_dict() for share in result]
+        return {'ref': ref, 'ok': True, 'result': result}
+
+    def write(result):
+        out.write(json.dumps(result) + '\n')
+        out.flush()
+
+    items = (
+        (number, line) for number, line in enumerate(lines, 1)
+        if line.strip()
+    )
+    from concurrent.futures import ThreadPoolExecutor
+    pending = collections.deque()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for item in items:
+            pending.append(executor.submit(perform, item))
+            if len(pending) > concurrency * 2:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+
+
+def run_plan(ocs, plan, out, dry_run=False, concurrency=10):
+    """Print or perform a SharePlan, reporting each step as it finishes
+
+    Returns the number of steps that failed.
+    """
+    counts = plan.counts()
+    if dry_run:
+        for step in plan.steps:
+            print(plan.describe(step), file=out)
+        print('%d to create, %d to update, %d to delete' % (
+            counts['create'], counts['update'], counts['delete']
+        ), file=out)
+        return 0
+
+    lock = threading.Lock()
+    failed = collections.Counter()
+
+    def report(step, result):
+        with lock:
+            if isinstance(result, Exception):
+                failed[step[0]] += 1
+                status = 'failed: %s' % result
             else:
-                permissions = None
+                status = 'ok'
+            report.done += 1
+            print('[%d/%d] %s %s' % (
+                report.done, len(plan), plan.describe(step), status
+            ), file=out)
+    report.done = 0
+
+    # A client with its own controller, like a fleet account sharing its
+    # server's limit, is paced by that instead
+    controller = None
+    if ocs.controller is None:
+        controller = ConcurrencyController(maximum=concurrency)
+    start = time.perf_counter()
+    plan.execute(ocs, controller, report)
+    seconds = time.perf_counter() - start
+    print('%d created, %d updated, %d deleted, %d failed in %.1fs '
+          '(%.1f/s)' % (
+              counts['create'] - failed['create'],
+              counts['update'] - failed['update'],
+              counts['delete'] - failed['delete'],
+              sum(failed.values()),
+              seconds,
+              len(plan) / seconds if seconds else 0
+          ), file=out)
+    return sum(failed.values())
+
+
+def ocroot_to_cloud(ocroot):
+    """Return a to_cloud function stripping ocroot, like get_ocpath"""
+    def to_cloud(path):
+        path = os.path.realpath(path)
+        if path.find(ocroot) == 0:
+            path = path[len(ocroot):]
+        return path
+    return to_cloud
+
+
+def select_shares(table, args):
+    """Apply the bulk command's filters to a ShareTable"""
+    if args.share_type:
+        table = table.of_type(*args.share_type)
+    if args.with_permissions is not None:
+        table = table.with_permissions(args.with_permissions)
+    if args.without_permissions is not None:
+        table = table.without_permissions(args.without_permissions)
+    if args.path:
+        table = table.under(args.path)
+    if args.share_with:
+        table = table.shared_with(*args.share_with)
+    if args.expires_after or args.expires_before:
+        table = table.expiring(args.expires_after, args.expires_before)
+    if args.no_expiration:
+        table = table.without_expiration()
+    if args.duplicates:
+        table = table.duplicates()
+    return table
+
+
+def run_bulk(ocs, args, out):
+    """Run the bulk command, returns the number of changes that failed"""
+    table = select_shares(ocs.get_share_table(), args)
+    if args.action == 'list':
+        print_result(table, out)
+        return 0
+    if args.action == 'delete':
+        plan = table.plan_delete()
+    else:
+        expire_date = args.expire_date
+        if args.disable_expire_date:
+            expire_date = False
+        plan = table.plan_update(
+            allow=calcPermissions(args.permissions_allow, None, 0),
+            deny=calcPermissions(args.permissions_deny, None, 0),
+            password=args.share_password,
+            expire_date=expire_date
+        )
+    return run_plan(ocs, plan, out, args.dry_run, args.concurrency)
+
+
+def write_events(events, out):
+    for event in events:
+        out.write(json.dumps(event) + '\n')
+
+
+def run_snapshot(ocs, args, out):
+    """Run the snapshot and changes commands"""
+    import ocsharetools_snapshot
+    source = ocsharetools_snapshot.source_name(ocs)
+    with ocsharetools_snapshot.SnapshotStore(args.db) as store:
+        if args.subparser_name == "snapshot":
+            snapshot = store.save(ocs.iter_share_data(), source)
+            write_events(store.events(snapshot=snapshot), out)
+        else:
+            write_events(store.events(since=args.since, source=source), out)
+
+
+def run_tree(ocs, args, out):
+    """Run create --recursive, returns the number of creates that failed
+
+    Failing to list the existing shares is reported on out and counts as
+    one failure.
+    """
+    import requests
+    to_cloud = None
+    if args.ocroot:
+        to_cloud = ocroot_to_cloud(args.ocroot)
+    try:
+        plan = plan_tree(
+            ocs,
+            args.path,
+            args.share_type,
+            share_with=args.share_with,
+            permissions=calcPermissions(
+                args.permissions_allow,
+                args.permissions_deny,
+                defaultPermissions(args.share_type)
+            ),
+            public_upload=args.public_upload,
+            password=args.share_password,
+            max_depth=args.max_depth,
+            to_cloud=to_cloud,
+            controller=ConcurrencyController(maximum=args.concurrency)
+        )
+    except (OCShareException, requests.exceptions.RequestException) as e:
+        print('listing existing shares failed: %s' % e, file=out)
+        return 1
+    return run_plan(ocs, plan, out, args.dry_run, args.concurrency)
+
+
+class PrefixedOutput:
+    """Writes whole lines to out, each starting with prefix
+
+    Several threads can write to the same out through their own
+    PrefixedOutput without their lines getting mixed up.
+    """
+
+    def __init__(self, out, prefix, lock):
+        self.out = out
+        self.prefix = prefix
+        self.lock = lock
+        self._pending = ''
+
+    def write(self, text):
+        lines = (self._pending + text).split('\n')
+        self._pending = lines.pop()
+        if lines:
+            with self.lock:
+                for line in lines:
+                    self.out.write(self.prefix + line + '\n')
 
-            if args.disable_expire_date:
-                expire_date = False
-            elif args.expire_date:
-                expire_date = datetime.strptime(args.expire_date, "%d-%m-%Y")
+    def flush(self):
+        with self.lock:
+            self.out.flush()
+
+    def close(self):
+        if self._pending:
+            self.write('\n')
+
+
+FLEET_COMMANDS = ('getshares', 'getshare', 'bulk')
+
+
+def run_fleet(fleet, args, out, err):
+    """Run a command on every account of an OCShareFleet at once
+
+    Each line written is prefixed with the account's name, or in the
+    other formats each share has it as its first field, source. Returns
+    the number of accounts the command failed on.
+    """
+    lock = threading.Lock()
+    names = dict((ocs, name) for name, ocs in fleet.clients.items())
+
+    writer = None
+    if args.subparser_name != "bulk" and args.format != 'text':
+        # One document for all accounts, with each share's account in
+        # its source field, which comes first whatever --fields says
+        fields = args.fields
+        if fields is None and args.format in ('csv', 'tsv'):
+            fields = TABLE_FIELDS
+        if fields is not None:
+            fields = ('source',) + tuple(
+                field for field in fields if field != 'source'
+            )
+        writer = ShareWriter(out, args.format, fields)
+
+    def run_account(ocs):
+        prefixed = PrefixedOutput(out, names[ocs] + ': ', lock)
+        errors = PrefixedOutput(err, names[ocs] + ': ', lock)
+        try:
+            if args.subparser_name == "bulk":
+                return run_bulk(ocs, args, prefixed)
+            if writer is None:
+                run_command(ocs, args, prefixed)
             else:
-                expire_date = None
-
-            ocs.update_share_by_id(
-                share_id=args.id,
-                permissions=permissions,
-                password=args.share_password,
-                public_upload=args.public_upload,
-                expire_date=expire_date
+                run_command(ocs, args, prefixed, errors, writer, names[ocs])
+            return 0
+        finally:
+            prefixed.close()
+            errors.close()
+
+    failed = 0
+    for name, result in fleet.map(run_account).items():
+        if isinstance(result, Exception):
+            print('%s: %s' % (name, result), file=err)
+        if isinstance(result, Exception) or result:
+            failed += 1
+    if writer is not None:
+        writer.close()
+    return failed
+
+
+DAEMON_COMMANDS = BATCH_COMMANDS + ('gui',)
+
+
+def run():
+    parser, subparsers = make_parser()
+    args = parser.parse_args()
+    recursive = args.subparser_name == "create" and args.recursive
+    if args.accounts:
+        if args.subparser_name not in FLEET_COMMANDS:
+            parser.error('--accounts only works with %s' % ', '.join(
+                FLEET_COMMANDS
+            ))
+    elif not (args.username and args.password and args.url):
+        parser.error('--username, --password and --url are required, '
+                     'unless --accounts is given')
+    elif args.account_names:
+        parser.error('--account needs --accounts')
+    # Listings in the other formats are streamed, the daemon would buffer
+    # the whole output
+    streamed = (args.subparser_name == "getshares" and
+                args.format != 'text')
+    if (args.subparser_name == "bulk" and args.action != "list" and
+            not args.all and not (
+                args.share_type or args.with_permissions is not None or
+                args.without_permissions is not None or args.path or
+                args.share_with or args.expires_after or
+                args.expires_before or args.no_expiration or
+                args.duplicates)):
+        parser.error('bulk %s without filters changes every share, '
+                     'pass --all to do that' % args.action)
+    if (not args.no_daemon and not args.stats and not recursive and
+            not streamed and not args.accounts and
+            args.subparser_name in DAEMON_COMMANDS):
+        import ocsharetools_daemon
+        status = ocsharetools_daemon.forward(args)
+        if status is not None:
+            sys.exit(status)
+    if args.subparser_name == "apply":
+        try:
+            manifest = ShareManifest.load(args.manifest)
+        except ValueError as e:
+            parser.error('%s: %s' % (args.manifest.name, e))
+    if (args.subparser_name == "bulk" and args.action == "update" and
+            not (args.permissions_allow or args.permissions_deny or
+                 args.share_password or args.expire_date or
+                 args.disable_expire_date)):
+        parser.error('bulk update needs permission flags, --share-password, '
+                     '--expire-date or --disable-expire-date')
+    if args.accounts:
+        metrics = Metrics() if args.stats else None
+        try:
+            fleet = OCShareFleet.load(
+                args.accounts,
+                args.account_names,
+                metrics
             )
-    except OCShareException as e:
-        print(e)
+        except ValueError as e:
+            parser.error('%s: %s' % (args.accounts.name, e))
+        try:
+            failed = run_fleet(fleet, args, sys.stdout, sys.stderr)
+        finally:
+            fleet.close()
+            if metrics is not None:
+                print(metrics.summary(), file=sys.stderr)
+        if failed:
+            sys.exit(1)
+        return
+    pool_size = 10
+    controller = None
+    if args.subparser_name in ("apply", "bulk") or recursive:
+        pool_size = max(pool_size, args.concurrency)
+    elif args.subparser_name == "batch":
+        pool_size = max(pool_size, args.concurrency)
+        if args.concurrency > 1:
+            # Ramp up to --concurrency, backing off if the server struggles
+            controller = ConcurrencyController(maximum=args.concurrency)
+    ocs = OCShareAPI(
+        args.url,
+        args.username,
+        args.password,
+        args.disable_ssl_verification,
+        pool_size=pool_size,
+        controller=controller,
+        metrics=Metrics() if args.stats else None
+    )
+    if args.subparser_name == "gui":
+        import ocsharetools_gui
+        ocsharetools_gui.run(args)
+    try:
+        if args.subparser_name == "batch":
+            run_batch(
+                ocs,
+                subparsers,
+                args.file,
+                sys.stdout,
+                args.concurrency
+            )
+        elif args.subparser_name == "apply":
+            plan = manifest.plan(ocs.get_shares())
+            if run_plan(ocs, plan, sys.stdout, args.dry_run,
+                        args.concurrency):
+                sys.exit(1)
+        elif args.subparser_name == "bulk":
+            if run_bulk(ocs, args, sys.stdout):
+                sys.exit(1)
+        elif args.subparser_name in ("snapshot", "changes"):
+            run_snapshot(ocs, args, sys.stdout)
+        elif recursive:
+            try:
+                failed = run_tree(ocs, args, sys.stdout)
+            except ValueError as e:
+                parser.error(str(e))
+            if failed:
+                sys.exit(1)
+        else:
+            run_command(ocs, args)
+    finally:
+        ocs.close()
+        if ocs.metrics is not None:
+            print(ocs.metrics.summary(), file=sys.stderr)
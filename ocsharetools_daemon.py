@@ -0,0 +1,312 @@
+"""Resident ocsharetools process
+
+ocsharetools-daemon keeps warm OCShareAPI connections, share caches and the
+sync folder map, and serves ocsharetools commands over a Unix domain socket.
+While it runs, the ocsharetools command forwards getshares, getshare,
+create, update, delete and gui to it instead of doing the work itself,
+which saves the interpreter, import and TLS start up cost of every call.
+"""
+
+import os
+import sys
+import json
+import stat
+import socket
+import struct
+import argparse
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        runtime_dir = '/tmp/ocsharetools-%d' % os.getuid()
+    return os.path.join(runtime_dir, 'ocsharetools.sock')
+
+
+def safe_directory(directory):
+    """Return whether directory is only reachable by this user
+
+    It must be a real directory, not a symlink, owned by this user with
+    mode 0700, so nobody else can have put a socket there to collect the
+    credentials commands carry.
+    """
+    try:
+        st = os.lstat(directory)
+    except OSError:
+        return False
+    return (
+        stat.S_ISDIR(st.st_mode) and
+        st.st_uid == os.getuid() and
+        stat.S_IMODE(st.st_mode) == 0o700
+    )
+
+
+def peer_uid(sock):
+    """Return the uid of the process at the other end of a unix socket,
+    or None where the platform can't tell"""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = sock.getsockopt(
+        socket.SOL_SOCKET,
+        socket.SO_PEERCRED,
+        struct.calcsize('3i')
+    )
+    return struct.unpack('3i', credentials)[1]
+
+
+def forward(args, socket_path=None):
+    """Run a parsed ocsharetools command in the daemon
+
+    Returns the command's exit status, or None when no daemon is running
+    (or it can't run the command) and the caller should run it itself.
+    Nothing is sent unless the socket's directory is safe_directory()
+    and the daemon runs as this user.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    if socket_path is None:
+        socket_path = default_socket_path()
+    if not safe_directory(os.path.dirname(socket_path)):
+        return None
+    request = dict(vars(args))
+    # Resolve local paths here, the daemon has a different working directory
+    if request['subparser_name'] == 'gui':
+        request['path'] = [os.path.abspath(path) for path in request['path']]
+    elif request.get('ocroot'):
+        import ocsharetools_cli
+        request['path'] = ocsharetools_cli.get_ocpath(args)
+        request['ocroot'] = None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        if peer_uid(sock) != os.getuid():
+            sock.close()
+            return None
+    except OSError:
+        sock.close()
+        return None
+    with sock, sock.makefile('rwb') as stream:
+        stream.write(json.dumps(request).encode('utf-8') + b'\n')
+        stream.flush()
+        reply = stream.readline()
+    if not reply:
+        return None
+    reply = json.loads(reply.decode('utf-8'))
+    if reply['status'] is None:
+        return None
+    sys.stdout.write(reply['stdout'])
+    sys.stderr.write(reply['stderr'])
+    return reply['status']
+
+
+class Daemon:
+    """Serves forwarded commands, see forward()
+
+    Keyword arguments:
+        socket_path -- Unix socket to listen on
+        cache_ttl -- Seconds gui windows cache share listings for, 0
+                     disables caching. Other commands always see the
+                     server's current shares, like when run directly
+        gui -- Show gui commands from this process, needs PyQt5
+    """
+
+    def __init__(self, socket_path=None, cache_ttl=30, gui=True):
+        import threading
+        self.socket_path = socket_path or default_socket_path()
+        self.cache_ttl = cache_ttl
+        self.gui = gui
+        self.clients = {}
+        self.windows = set()
+        self._lock = threading.Lock()
+        self._show_window = None
+
+    def client(self, args, cached=False):
+        """Return the warm OCShareAPI for a command's server and account
+
+        With cached, the client caches share listings for cache_ttl.
+        """
+        import ocsharetools
+        key = (
+            args.url,
+            args.username,
+            args.password,
+            args.disable_ssl_verification
+        )
+        cached = bool(cached and self.cache_ttl)
+        with self._lock:
+            ocs = self.clients.get(key + (cached,))
+            if ocs is None:
+                cache = None
+                if cached:
+                    cache = ocsharetools.ShareCache(ttl=self.cache_ttl)
+                ocs = self.clients[key + (cached,)] = (
+                    ocsharetools.OCShareAPI(*key, cache=cache)
+                )
+        return ocs
+
+    def handle(self, request):
+        """Run a forwarded command, returns the reply for forward()"""
+        import io
+        import traceback
+        import ocsharetools_cli
+        args = argparse.Namespace(**request)
+        # Changes made elsewhere show up at once for commands, only gui
+        # windows trade that for speed
+        ocs = self.client(args, cached=args.subparser_name == 'gui')
+        if args.subparser_name == 'gui':
+            if self._show_window is None:
+                return {'status': None}
+            self._show_window.emit((args, ocs))
+            return {'status': 0, 'stdout': '', 'stderr': ''}
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        try:
+            ocsharetools_cli.run_command(ocs, args, stdout, stderr)
+        except Exception:
+            return {
+                'status': 1,
+                'stdout': stdout.getvalue(),
+                'stderr': stderr.getvalue() + traceback.format_exc()
+            }
+        return {
+            'status': 0,
+            'stdout': stdout.getvalue(),
+            'stderr': stderr.getvalue()
+        }
+
+    def bind(self):
+        import socketserver
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                if peer_uid(self.connection) != os.getuid():
+                    return
+                line = self.rfile.readline()
+                if not line:
+                    return
+                reply = daemon.handle(json.loads(line.decode('utf-8')))
+                self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+        directory = os.path.dirname(self.socket_path)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if not safe_directory(directory):
+            raise RuntimeError(
+                '%s must be a directory owned by you with mode 0700, '
+                'not a symlink' % directory
+            )
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except OSError:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        else:
+            raise RuntimeError(
+                'A daemon is already listening on %s' % self.socket_path
+            )
+        finally:
+            probe.close()
+        old_umask = os.umask(0o077)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(
+                self.socket_path,
+                Handler
+            )
+        finally:
+            os.umask(old_umask)
+        server.daemon_threads = True
+        return server
+
+    def serve_forever(self):
+        """Serve commands until interrupted"""
+        import ocsharetools
+        server = self.bind()
+        ocsharetools.sync_folder_map().reload()
+        try:
+            if self.gui:
+                self._serve_gui(server)
+            else:
+                server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(self.socket_path)
+            for ocs in self.clients.values():
+                ocs.close()
+
+    def _serve_gui(self, server):
+        """Serve from a thread while Qt runs the main thread"""
+        import threading
+        import signal
+        from PyQt5 import QtCore, QtWidgets
+        import ocsharetools_gui
+
+        daemon = self
+
+        class WindowOpener(QtCore.QObject):
+            show = QtCore.pyqtSignal(object)
+
+            def open(self, request):
+                args, ocs = request
+                window = ocsharetools_gui.OCShareTool(args, ocs)
+                if not window.cloud_paths:
+                    window.deleteLater()
+                    return
+                window.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+                daemon.windows.add(window)
+                window.destroyed.connect(
+                    lambda: daemon.windows.discard(window)
+                )
+                app.focusChanged.connect(window.focus_changed)
+                window.activateWindow()
+
+        app = QtWidgets.QApplication(sys.argv[:1])
+        app.setQuitOnLastWindowClosed(False)
+        opener = WindowOpener()
+        opener.show.connect(opener.open)
+        self._show_window = opener.show
+        signal.signal(signal.SIGINT, lambda *args: app.quit())
+        signal.signal(signal.SIGTERM, lambda *args: app.quit())
+        # Wake the event loop now and then so the signal handlers run
+        timer = QtCore.QTimer()
+        timer.timeout.connect(lambda: None)
+        timer.start(500)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            app.exec_()
+        finally:
+            server.shutdown()
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description='Keep ocsharetools warm, the ocsharetools command '
+                    'forwards its commands here while this runs'
+    )
+    parser.add_argument(
+        '--socket',
+        default=default_socket_path(),
+        help='unix socket to listen on, in a directory only you can '
+             'access (mode 0700) (default %(default)s)'
+    )
+    parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        default=30,
+        help='seconds gui windows cache share listings for, 0 to '
+             'disable (default %(default)s)'
+    )
+    parser.add_argument(
+        '--no-gui',
+        action='store_true',
+        help="don't load PyQt5 and show gui commands from the daemon"
+    )
+    args = parser.parse_args()
+    Daemon(args.socket, args.cache_ttl, not args.no_gui).serve_forever()
+
+
+if __name__ == '__main__':
+    run()
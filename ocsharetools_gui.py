@@ -5,53 +5,173 @@ import shutil
 from ocsharetools import *
 
 
+class TaskSignals(QtCore.QObject):
+    finished = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(object)
+
+
+class Task(QtCore.QRunnable):
+    """Calls a function on a worker thread
+
+    The result, or the exception raised, is delivered through signals,
+    which Qt queues to the thread the TaskSignals object lives in.
+    """
+
+    def __init__(self, function):
+        super(Task, self).__init__()
+        self.function = function
+        self.signals = TaskSignals()
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            result = self.function()
+        except Exception as e:
+            if not self.cancelled:
+                self.signals.failed.emit(e)
+            return
+        if not self.cancelled:
+            self.signals.finished.emit(result)
+
+
+UPDATE_DELAY = 400
+
+_task_pool = None
+
+
+def task_pool():
+    """Return the thread pool windows run their tasks on
+
+    It belongs to no window, so closing a window never waits for the
+    requests it has in flight, which would block every other window of
+    the daemon.
+    """
+    global _task_pool
+    if _task_pool is None:
+        _task_pool = QtCore.QThreadPool()
+    return _task_pool
+
+
 class OCShareTool(QtWidgets.QWidget):
 
-    def __init__(self, args):
+    def __init__(self, args, ocs=None):
         super(OCShareTool, self).__init__()
         self.args = args
-        if not os.path.exists(args.path):
+        if ocs is None:
+            ocs = OCShareAPI(
+                args.url,
+                args.username,
+                args.password,
+                args.disable_ssl_verification
+            )
+        self.ocs = ocs
+        self.dialog_open = False
+        self.closed = False
+        self.shares = {}
+        # Permissions of each share as last known on the server, restored
+        # when an update fails
+        self.confirmed_permissions = {}
+        # A flush is in flight, the next one waits for it
+        self.flushing = False
+        self.flush_task = None
+        self.rows = {}
+        self.public_shares = {}
+        self.tasks = set()
+        self.pool = task_pool()
+        self.pool.setMaxThreadCount(max(
+            self.pool.maxThreadCount(),
+            getattr(ocs, 'pool_size', 10)
+        ))
+        # Permission and expiry changes are merged per share and sent once
+        # the user has stopped clicking for UPDATE_DELAY milliseconds
+        self.updates = ShareUpdateQueue(ocs, delay=None)
+        self.flush_timer = QtCore.QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(UPDATE_DELAY)
+        self.flush_timer.timeout.connect(self.flush_updates)
+        paths = args.path
+        if isinstance(paths, str):
+            paths = [paths]
+        self.cloud_paths = self.find_cloud_paths(paths)
+        if self.cloud_paths:
+            self.initUI()
+
+    def files_text(self, count, one, many):
+        if count == 1:
+            return one
+        return many % count
+
+    def find_cloud_paths(self, paths):
+        """Return the cloud paths of the given local paths
+
+        Files that don't exist are skipped, and moving files outside of the
+        sync folders to instant uploads is offered. An empty list means
+        there's nothing left to share.
+        """
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
             QtWidgets.QMessageBox.critical(
                 self,
                 'OC Share Tools',
-                'File does not exist',
+                self.files_text(
+                    len(missing),
+                    'File does not exist',
+                    '%d files do not exist'
+                ),
                 QtWidgets.QMessageBox.Ok
             )
-            sys.exit(0)
-
-        self.ocs = OCShareAPI(args.url, args.username, args.password, args.disable_ssl_verification)
-        self.public_share = None
-        self.dialog_open = False
-        self.cloud_path = full_path_to_cloud(args.path)
-        if self.cloud_path is None:
-            if args.instant_upload_path:
-                path = args.instant_upload_path
+            paths = [path for path in paths if path not in missing]
+
+        cloud_paths = []
+        outside = []
+        for path in paths:
+            cloud_path = full_path_to_cloud(path)
+            if cloud_path is None:
+                outside.append(path)
             else:
-                path = get_instant_upload_path()
-            if not path or not os.path.exists(path):
-                QtWidgets.QMessageBox.critical(
-                    self,
-                    'OC Share Tools',
+                cloud_paths.append(normalize_path(cloud_path))
+        if not outside:
+            return cloud_paths
+
+        if self.args.instant_upload_path:
+            path = self.args.instant_upload_path
+        else:
+            path = get_instant_upload_path()
+        if not path or not os.path.exists(path):
+            QtWidgets.QMessageBox.critical(
+                self,
+                'OC Share Tools',
+                self.files_text(
+                    len(outside),
                     'This file is not in an ownCloud share',
-                    QtWidgets.QMessageBox.Ok
-                )
-                sys.exit(0)
-            reply = QtWidgets.QMessageBox.question(
-                self, 'ownCloud',
-                'File is not in an ownCloud share directory. '
-                'Move to instant uploads?',
-                QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
-                QtWidgets.QMessageBox.No
+                    '%d files are not in an ownCloud share'
+                ),
+                QtWidgets.QMessageBox.Ok
             )
+            return cloud_paths
+        reply = QtWidgets.QMessageBox.question(
+            self, 'ownCloud',
+            self.files_text(
+                len(outside),
+                'File is not in an ownCloud share directory. ',
+                '%d files are not in an ownCloud share directory. '
+            ) + 'Move to instant uploads?',
+            QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+            QtWidgets.QMessageBox.No
+        )
 
-            if reply == QtWidgets.QMessageBox.Yes:
-                self.cloud_path = full_path_to_cloud(
-                    path+os.path.basename(args.path)
-                )
-                shutil.move(args.path, path)
-            else:
-                sys.exit(0)
-        self.initUI()
+        if reply == QtWidgets.QMessageBox.Yes:
+            for local_path in outside:
+                cloud_paths.append(normalize_path(full_path_to_cloud(
+                    path+os.path.basename(local_path)
+                )))
+                shutil.move(local_path, path)
+        return cloud_paths
 
     def initUI(self):
         self.setWindowFlags(
@@ -64,6 +184,12 @@ class OCShareTool(QtWidgets.QWidget):
         vbox.addStretch(1)
         vbox.setSizeConstraint(QtWidgets.QLayout.SetFixedSize)
 
+        if len(self.cloud_paths) > 1:
+            vbox.addWidget(QtWidgets.QLabel(
+                'Sharing %d files' % len(self.cloud_paths),
+                self
+            ))
+
         self.groupEdit = QtWidgets.QLineEdit()
         self.groupEdit.setPlaceholderText('Share with group...')
         vbox.addWidget(self.groupEdit)
@@ -98,6 +224,7 @@ class OCShareTool(QtWidgets.QWidget):
         )
 
         self.shareEdit = QtWidgets.QLineEdit()
+        self.shareEdit.setReadOnly(len(self.cloud_paths) > 1)
         self.shareHBox.addWidget(self.shareEdit)
         self.shareHBox.addWidget(self.copyButton)
         vbox.addLayout(self.shareHBox)
@@ -156,66 +283,365 @@ class OCShareTool(QtWidgets.QWidget):
                 self.clear_layout(item.layout())
             layout.removeItem(item)
 
+    def run_task(self, function, done=None, widgets=(), failed=None):
+        """Run function on the thread pool, keeping the window responsive
+
+        widgets are disabled until the task finishes, then done(result)
+        or failed(exception) is called on the main thread. failed defaults
+        to showing the error. Tasks still running when the window closes
+        are cancelled and report nothing.
+        """
+        task = Task(function)
+        if self.closed:
+            task.cancel()
+        for widget in widgets:
+            widget.setEnabled(False)
+
+        def finish():
+            self.tasks.discard(task)
+            for widget in widgets:
+                widget.setEnabled(True)
+
+        def on_finished(result):
+            if task.cancelled or self.closed:
+                return
+            finish()
+            if done is not None:
+                done(result)
+
+        def on_failed(exception):
+            if task.cancelled or self.closed:
+                return
+            finish()
+            (failed or self.show_error)(exception)
+
+        task.signals.finished.connect(on_finished)
+        task.signals.failed.connect(on_failed)
+        self.tasks.add(task)
+        self.pool.start(task)
+        return task
+
+    def run_each(self, function, items, done=None, widgets=()):
+        """Run function(item) for every item in parallel
+
+        Once all have finished, done(results, errors) is called with dicts
+        of the results and exceptions by item, and any errors are shown.
+        """
+        items = list(items)
+        results = {}
+        errors = {}
+        if not items:
+            if done is not None:
+                done(results, errors)
+            return
+        for widget in widgets:
+            widget.setEnabled(False)
+
+        def finish():
+            if len(results) + len(errors) < len(items):
+                return
+            for widget in widgets:
+                widget.setEnabled(True)
+            if done is not None:
+                done(results, errors)
+            if errors:
+                self.show_errors(errors)
+
+        def add_task(item):
+            def finished(result):
+                results[item] = result
+                finish()
+
+            def failed(exception):
+                errors[item] = exception
+                finish()
+
+            self.run_task(lambda: function(item), finished, failed=failed)
+
+        for item in items:
+            add_task(item)
+
+    def show_error(self, exception):
+        self.dialog_open = True
+        if isinstance(exception, OCShareException):
+            QtWidgets.QMessageBox.critical(
+                self,
+                'ownCloud Error %d' % (exception.status_code),
+                exception.message,
+                QtWidgets.QMessageBox.Ok
+            )
+        else:
+            QtWidgets.QMessageBox.critical(
+                self,
+                'ownCloud Error',
+                str(exception),
+                QtWidgets.QMessageBox.Ok
+            )
+        self.dialog_open = False
+
+    def show_errors(self, errors):
+        """Show the errors of a run_each, errors is keyed by path or share"""
+        if len(errors) == 1 and len(self.cloud_paths) == 1:
+            self.show_error(list(errors.values())[0])
+            return
+        lines = []
+        for item, exception in errors.items():
+            if isinstance(item, OCShare):
+                item = item.path
+            lines.append('%s: %s' % (item, exception))
+        self.dialog_open = True
+        QtWidgets.QMessageBox.critical(
+            self,
+            'ownCloud Error',
+            '\n'.join(lines),
+            QtWidgets.QMessageBox.Ok
+        )
+        self.dialog_open = False
+
+    def closeEvent(self, event):
+        self.flush_timer.stop()
+        if len(self.updates):
+            # Written on the pool, which outlives the window, so closing
+            # never waits on the network
+            self.pool.start(Task(self.updates.flush))
+        # Queued tasks return as soon as they start, running ones are
+        # left to finish on their own, their results are ignored. A flush
+        # already taken from the queue is still sent
+        self.closed = True
+        self.tasks.discard(self.flush_task)
+        for task in self.tasks:
+            task.cancel()
+        self.tasks.clear()
+        super(OCShareTool, self).closeEvent(event)
+
+    @staticmethod
+    def set_checked(checkbox, checked):
+        """Set a check box without triggering its stateChanged slots
+
+        checked is True, False, or None for partially checked. The check
+        box is only tristate while partially checked, so a click always
+        checks or unchecks it.
+        """
+        checkbox.blockSignals(True)
+        if checked is None:
+            checkbox.setCheckState(QtCore.Qt.PartiallyChecked)
+        else:
+            checkbox.setTristate(False)
+            checkbox.setChecked(checked)
+        checkbox.blockSignals(False)
+
+    @staticmethod
+    def clicked_state(checkbox, state):
+        """Return True or False for the state a click left a check box
+        in, or None for partially checked, which no change should follow"""
+        checkbox.setTristate(False)
+        if state == QtCore.Qt.Checked:
+            return True
+        if state == QtCore.Qt.Unchecked:
+            return False
+        return None
+
+    @staticmethod
+    def all_or_none(values):
+        """True if all values are true, False if none are, else None"""
+        values = [bool(value) for value in values]
+        if all(values):
+            return True
+        if not any(values):
+            return False
+        return None
+
     def get_shares(self):
-        self.shares = {}
-        if self.cloud_path:
-            try:
-                shares = self.ocs.get_shares(path=self.cloud_path)
-                for share in shares:
-                    self.shares[share.id] = share
-            except OCShareException:
-                pass
-        self.clear_layout(self.shareListVBox)
-        for share_id, share in self.shares.items():
-            if share.share_type == 3:
-                self.shareCB.setChecked(True)
-                self.shareEdit.setText(share.url)
-                self.show_share()
-                self.public_share = share
-                if share.share_with is not None:
-                    if self.passwordEdit.text() == '':
-                        self.passwordEdit.setText('********')
-                    self.passwordEdit.show()
-                    self.passwordCB.setChecked(True)
-                if share.expiration is not None:
-                    self.expirationCB.setChecked(True)
-                    self.calendar.show()
-                    date = datetime.datetime.strptime(
-                        share.expiration,
-                        "%Y-%m-%d %H:%M:%S"
-                    )
-                    self.calendar.setSelectedDate(
-                        QtCore.QDate(date.year, date.month, date.day)
-                    )
-            else:
-                self.add_share_widgets(share)
+        def done(results, errors):
+            for path, shares in results.items():
+                self.apply_shares(shares, complete_path=path)
+            for path, exception in list(errors.items()):
+                # The server answers 404 for paths without shares
+                if isinstance(exception, OCShareException):
+                    self.apply_shares([], complete_path=path)
+                    del errors[path]
+
+        self.run_each(
+            lambda path: self.ocs.get_shares(path=path),
+            self.cloud_paths,
+            done
+        )
 
-    def add_share_widgets(self, share):
-        if share.share_type == 1:
-            title = '%s (group)' % (share.share_with)
+    @staticmethod
+    def share_key(share):
+        """Shares with the same user or group are shown as one row"""
+        return (share.share_type, share.share_with)
+
+    def apply_shares(self, shares, complete_path=None):
+        """Bring the window in line with shares from the server
+
+        Only the rows of shares that changed are touched. With
+        complete_path, shares is the whole listing of that path and shares
+        of the path missing from it are removed too.
+        """
+        keys = set()
+        seen = set()
+        public = False
+        for share in shares:
+            seen.add(share.id)
+            old = self.shares.get(share.id)
+            if old is not None and old.share_type != SHARETYPE_PUBLIC:
+                keys.add(self.share_key(old))
+            self.shares[share.id] = share
+            self.confirmed_permissions[share.id] = share.permissions
+            if share.share_type == SHARETYPE_PUBLIC:
+                self.public_shares[normalize_path(share.path)] = share
+                public = True
+            else:
+                keys.add(self.share_key(share))
+        if complete_path is not None:
+            for share in list(self.shares.values()):
+                if (normalize_path(share.path) == complete_path and
+                        share.id not in seen):
+                    public |= self.remove_share(share)
+                    if share.share_type != SHARETYPE_PUBLIC:
+                        keys.add(self.share_key(share))
+        for key in keys:
+            self.update_row(key)
+        if public:
+            self.show_public_shares()
+
+    def remove_share(self, share):
+        """Forget a share, returns whether it was a public link"""
+        self.shares.pop(share.id, None)
+        self.confirmed_permissions.pop(share.id, None)
+        self.updates.discard(share.id)
+        path = normalize_path(share.path)
+        if self.public_shares.get(path) is share:
+            del self.public_shares[path]
+            return True
+        return False
+
+    def forget_shares(self, shares):
+        """Remove deleted shares from the window"""
+        keys = set()
+        public = False
+        for share in shares:
+            public |= self.remove_share(share)
+            if share.share_type != SHARETYPE_PUBLIC:
+                keys.add(self.share_key(share))
+        for key in keys:
+            self.update_row(key)
+        if public:
+            self.show_public_shares()
+
+    def row_shares(self, key):
+        return [
+            share for share in self.shares.values()
+            if share.share_type != SHARETYPE_PUBLIC and
+            self.share_key(share) == key
+        ]
+
+    def share_title(self, key, count):
+        share_type, share_with = key
+        if share_type == SHARETYPE_GROUP:
+            title = '%s (group)' % (share_with)
         else:
-            title = share.share_with
-        hbox = QtWidgets.QHBoxLayout()
-        hbox.addWidget(
-            QtWidgets.QLabel(
+            title = share_with
+        if len(self.cloud_paths) > 1:
+            title = '%s on %d/%d files' % (
                 title,
-                self
+                count,
+                len(self.cloud_paths)
+            )
+        return title
+
+    def update_row(self, key):
+        """Add, update or remove the row of a user or group"""
+        shares = self.row_shares(key)
+        row = self.rows.get(key)
+        if not shares:
+            if row is not None:
+                del self.rows[key]
+                self.clear_layout(row['layout'])
+                self.shareListVBox.removeItem(row['layout'])
+            return
+        if row is None:
+            row = self.add_share_widgets(key)
+        title = self.share_title(key, len(shares))
+        if row['label'].text() != title:
+            row['label'].setText(title)
+        for permission in (PERMISSION_SHARE, PERMISSION_UPDATE):
+            checked = self.all_or_none(
+                share.permissions & permission for share in shares
             )
+            self.set_checked(row[permission], checked)
+
+    def show_public_shares(self):
+        links = [
+            self.public_shares[path] for path in self.cloud_paths
+            if path in self.public_shares
+        ]
+        if not links:
+            self.set_checked(self.shareCB, False)
+            self.hide_share()
+            return
+        self.set_checked(
+            self.shareCB,
+            True if len(links) == len(self.cloud_paths) else None
         )
-        canShare = QtWidgets.QCheckBox('can share', self)
-        self.setup_share_tickbox(
-            canShare,
-            share,
-            PERMISSION_SHARE
+        if len(links) == 1:
+            text = links[0].url
+        else:
+            text = '%d links' % len(links)
+        if self.shareEdit.text() != text:
+            self.shareEdit.setText(text)
+        self.show_share()
+        password = self.all_or_none(
+            share.share_with is not None for share in links
         )
-        hbox.addWidget(canShare)
-        canShare = QtWidgets.QCheckBox('can edit', self)
-        self.setup_share_tickbox(
-            canShare,
-            share,
-            PERMISSION_UPDATE
+        if password is not False:
+            if self.passwordEdit.text() == '':
+                self.passwordEdit.setText('********')
+            self.passwordEdit.show()
+        self.set_checked(self.passwordCB, password)
+        expiring = [share for share in links if share.expiration is not None]
+        self.set_checked(
+            self.expirationCB,
+            self.all_or_none(share.expiration is not None for share in links)
+        )
+        if expiring:
+            self.calendar.show()
+            date = datetime.datetime.strptime(
+                expiring[0].expiration,
+                "%Y-%m-%d %H:%M:%S"
+            )
+            date = QtCore.QDate(date.year, date.month, date.day)
+            if self.calendar.selectedDate() != date:
+                self.calendar.setSelectedDate(date)
+        else:
+            self.calendar.hide()
+
+    def refresh_shares(self, shares):
+        """Fetch shares again by id and apply them"""
+        def done(results, errors):
+            self.apply_shares(results.values())
+            self.forget_shares([
+                share for share, exception in errors.items()
+                if isinstance(exception, OCShareException)
+            ])
+
+        self.run_each(
+            lambda share: self.ocs.get_share_by_id(share.id),
+            shares,
+            done
         )
+
+    def add_share_widgets(self, key):
+        hbox = QtWidgets.QHBoxLayout()
+        label = QtWidgets.QLabel(self)
+        hbox.addWidget(label)
+        canShare = QtWidgets.QCheckBox('can share', self)
+        self.setup_share_tickbox(canShare, key, PERMISSION_SHARE)
         hbox.addWidget(canShare)
+        canEdit = QtWidgets.QCheckBox('can edit', self)
+        self.setup_share_tickbox(canEdit, key, PERMISSION_UPDATE)
+        hbox.addWidget(canEdit)
         deleteButton = QtWidgets.QPushButton(
             QtGui.QIcon.fromTheme('edit-delete'),
             '',
@@ -226,56 +652,154 @@ class OCShareTool(QtWidgets.QWidget):
             QtWidgets.QSizePolicy.Fixed
         )
         deleteButton.clicked.connect(
-            self.create_delete_button(hbox, share)
+            self.create_delete_button(hbox, key)
         )
 
         hbox.addWidget(deleteButton)
         self.shareListVBox.addLayout(hbox)
+        row = self.rows[key] = {
+            'layout': hbox,
+            'label': label,
+            PERMISSION_SHARE: canShare,
+            PERMISSION_UPDATE: canEdit
+        }
+        return row
 
     def add_share(self, share_type, line_edit):
-        try:
-            share = self.ocs.create_share(
-                path=self.cloud_path,
+        """Share the files that aren't shared with the user or group yet"""
+        def done(results, errors):
+            self.apply_shares(results.values())
+            line_edit.setText('')
+
+        share_with = line_edit.text()
+        shared = set(
+            normalize_path(share.path) for share in
+            self.row_shares((share_type, share_with))
+        )
+        self.run_each(
+            lambda path: self.ocs.create_share(
+                path=path,
                 share_type=share_type,
-                share_with=line_edit.text()
-            )
-            self.shares[share.id] = share
-            self.add_share_widgets(share)
-        except OCShareException as e:
-            self.dialog_open = True
-            QtWidgets.QMessageBox.critical(
-                self,
-                'ownCloud Error %d' % (e.status_code),
-                e.message,
-                QtWidgets.QMessageBox.Ok
-            )
-            self.dialog_open = False
-        line_edit.setText('')
+                share_with=share_with
+            ),
+            [path for path in self.cloud_paths if path not in shared],
+            done,
+            [line_edit]
+        )
+
+    def update_links(self, widgets=(), done=None, **kwargs):
+        """Update every public link with the same arguments"""
+        def updated(results, errors):
+            if done is not None:
+                done(results, errors)
+
+        self.run_each(
+            lambda share: share.update(**kwargs),
+            list(self.public_shares.values()),
+            updated,
+            widgets
+        )
 
     def date_selected(self, date):
-        self.public_share.update(expire_date=date.toPyDate())
+        date = date.toPyDate()
+        for share in self.public_shares.values():
+            self.updates.update(share.id, expire_date=date)
+        self.flush_timer.start()
+
+    def flush_updates(self):
+        """Send the queued share updates
+
+        The changes are taken from the queue here, so what the server
+        confirms is what was sent, not what was clicked since. One flush
+        runs at a time, changes queued meanwhile go out after it.
+        """
+        def finished():
+            self.flushing = False
+            if len(self.updates):
+                self.flush_timer.start()
+
+        def done(results):
+            finished()
+            errors = {}
+            for share_id, exception in results.items():
+                share = self.shares.get(share_id)
+                if share is None:
+                    continue
+                if exception is None:
+                    if 'permissions' in sent[share_id]:
+                        self.confirmed_permissions[share_id] = (
+                            sent[share_id]['permissions']
+                        )
+                else:
+                    errors[share] = exception
+            if errors:
+                self.revert_shares(list(errors))
+                self.show_errors(errors)
+                # Find out what the server made of the failed shares
+                self.refresh_shares(list(errors))
+
+        def failed(exception):
+            finished()
+            self.show_error(exception)
+
+        if self.flushing or not len(self.updates):
+            return
+        sent = self.updates.take()
+        self.flushing = True
+        self.flush_task = self.run_task(
+            lambda: self.updates.send(sent),
+            done,
+            failed=failed
+        )
 
-    def create_delete_button(self, hbox, share):
+    def revert_shares(self, shares):
+        """Show shares as last known on the server, after failed updates
+
+        Permissions changed in the window are put back, and the link
+        widgets are redrawn, undoing expiry changes that weren't made.
+        """
+        keys = set()
+        public = False
+        for share in shares:
+            share.permissions = self.confirmed_permissions.get(
+                share.id,
+                share.permissions
+            )
+            if share.share_type == SHARETYPE_PUBLIC:
+                public = True
+            else:
+                keys.add(self.share_key(share))
+        for key in keys:
+            self.update_row(key)
+        if public:
+            self.show_public_shares()
+
+    def create_delete_button(self, hbox, key):
         return lambda checked: self.delete_clicked(
             checked,
-            share,
+            key,
             hbox
         )
 
-    def delete_clicked(self, event, share, layout):
-        del self.shares[share.id]
-        share.delete()
-        self.clear_layout(layout)
-        self.shareListVBox.removeItem(layout)
+    def delete_clicked(self, event, key, layout):
+        def done(results, errors):
+            self.forget_shares(list(results))
 
-    def setup_share_tickbox(self, checkbox, share, permission):
-        if share.permissions & permission:
-            checkbox.setChecked(True)
+        widgets = [layout.itemAt(i).widget() for i in range(layout.count())]
+        self.run_each(
+            lambda share: self.ocs.delete_share_by_id(share.id),
+            self.row_shares(key),
+            done,
+            widgets
+        )
+
+    def setup_share_tickbox(self, checkbox, key, permission):
         checkbox.stateChanged.connect(
             lambda state: self.change_permission(
                 state,
-                share,
-                permission
+                key,
+                permission,
+                checkbox
             )
         )
 
@@ -283,10 +807,10 @@ class OCShareTool(QtWidgets.QWidget):
         self.shareEdit.hide()
         self.copyButton.hide()
         self.passwordCB.hide()
-        self.passwordCB.setChecked(False)
+        self.set_checked(self.passwordCB, False)
         self.passwordEdit.hide()
         self.expirationCB.hide()
-        self.expirationCB.setChecked(False)
+        self.set_checked(self.expirationCB, False)
         self.calendar.hide()
 
     def show_share(self):
@@ -295,62 +819,116 @@ class OCShareTool(QtWidgets.QWidget):
         self.passwordCB.show()
         self.expirationCB.show()
 
-    def change_permission(self, checked, share, permission):
-        if checked == QtCore.Qt.Checked:
-            share.update(permissions=share.permissions | permission)
-        else:
-            share.update(permissions=share.permissions & ~permission)
+    def change_permission(self, state, key, permission, checkbox):
+        """Give or take a permission on every share of a row"""
+        checked = self.clicked_state(checkbox, state)
+        if checked is None:
+            return
+        for share in self.row_shares(key):
+            if checked:
+                share.permissions |= permission
+            else:
+                share.permissions &= ~permission
+            self.updates.update(share.id, permissions=share.permissions)
+        self.update_row(key)
+        self.flush_timer.start()
 
     def set_password(self):
-        self.public_share.update(password=self.passwordEdit.text())
-        self.passwordEdit.setPlaceholderText('Password Set')
-        self.get_shares()
-        self.passwordEdit.setText('')
+        def done(results, errors):
+            self.passwordEdit.setPlaceholderText('Password Set')
+            self.passwordEdit.setText('')
+            self.refresh_shares(list(results))
+
+        self.update_links(
+            [self.passwordEdit, self.passwordCB],
+            done,
+            password=self.passwordEdit.text()
+        )
 
     def copy_button_clicked(self, event):
         clipboard = QtWidgets.QApplication.clipboard()
-        clipboard.setText(self.public_share.url)
+        clipboard.setText('\n'.join(
+            self.public_shares[path].url for path in self.cloud_paths
+            if path in self.public_shares
+        ))
 
     def password_check_changed(self, state):
-        if state == QtCore.Qt.Checked:
-            self.passwordEdit.show()
-        else:
-            self.public_share.update(password=False)
-            self.get_shares()
+        def done(results, errors):
+            self.refresh_shares(list(results))
             self.passwordEdit.setText('')
             self.passwordEdit.setPlaceholderText(
                 'Choose a password for the public link'
             )
             self.passwordEdit.hide()
+            if errors:
+                # Links whose password wasn't removed still have one
+                self.show_public_shares()
+
+        checked = self.clicked_state(self.passwordCB, state)
+        if checked:
+            self.passwordEdit.show()
+        elif checked is False:
+            self.update_links(
+                [self.passwordCB, self.passwordEdit],
+                done,
+                password=False
+            )
 
     def expiration_check_changed(self, state):
-        if state == QtCore.Qt.Checked:
+        # Goes through the update queue so it can't race queued dates
+        checked = self.clicked_state(self.expirationCB, state)
+        if checked is None:
+            return
+        if checked:
             self.calendar.show()
             date = datetime.date.today() + datetime.timedelta(days=1)
-            self.public_share.update(
-                expire_date=date
-            )
+            for share in self.public_shares.values():
+                self.updates.update(share.id, expire_date=date)
             date = QtCore.QDate(date.year, date.month, date.day)
             self.calendar.setSelectedDate(date)
-        elif self.public_share:
-            self.public_share.update(expire_date=False)
+        elif self.public_shares:
+            for share in self.public_shares.values():
+                self.updates.update(share.id, expire_date=False)
             self.calendar.hide()
+        self.flush_timer.stop()
+        self.flush_updates()
 
     def share_link(self, state):
-        if state == QtCore.Qt.Checked:
-            share = self.ocs.create_share(
-                path=self.cloud_path,
-                share_type=SHARETYPE_PUBLIC
+        """Create links for files that have none, or delete all links"""
+        checked = self.clicked_state(self.shareCB, state)
+        if checked is None:
+            return
+        if checked:
+            def created(results, errors):
+                self.apply_shares(results.values())
+                if errors:
+                    # Unchecks the box again if no link was created
+                    self.show_public_shares()
+
+            self.run_each(
+                lambda path: self.ocs.create_share(
+                    path=path,
+                    share_type=SHARETYPE_PUBLIC
+                ),
+                [
+                    path for path in self.cloud_paths
+                    if path not in self.public_shares
+                ],
+                created,
+                [self.shareCB]
             )
-            self.shares[share.id] = share
-            self.public_share = share
-            self.shareEdit.setText(self.public_share.url)
-            self.show_share()
         else:
-            del self.shares[self.public_share.id]
-            self.public_share.delete()
-            self.public_share = None
-            self.hide_share()
+            def deleted(results, errors):
+                self.forget_shares(list(results))
+                # Links that weren't deleted are still there
+                self.show_public_shares()
+
+            self.run_each(
+                lambda share: self.ocs.delete_share_by_id(share.id),
+                list(self.public_shares.values()),
+                deleted,
+                [self.shareCB]
+            )
 
     def keyPressEvent(self, e):
         if e.key() == QtCore.Qt.Key_Escape:
@@ -366,8 +944,12 @@ class OCShareTool(QtWidgets.QWidget):
 def run(args):
     app = QtWidgets.QApplication(sys.argv)
     ex = OCShareTool(args)
+    if not ex.cloud_paths:
+        sys.exit(0)
     app.focusChanged.connect(ex.focus_changed)
     e = app.exec_()
+    # Changes still being written when the window closed
+    task_pool().waitForDone()
     clipboard = QtWidgets.QApplication.clipboard()
     event = QtCore.QEvent(QtCore.QEvent.Clipboard)
     QtWidgets.QApplication.sendEvent(clipboard, event)
@@ -0,0 +1,249 @@
+"""Share listings kept in SQLite, to report what changed between fetches
+
+    store = SnapshotStore('shares.db')
+    snapshot = store.save(ocs.iter_share_data(), source_name(ocs))
+    for event in store.events(snapshot=snapshot):
+        print(event['event'], event['share_id'], event['changes'])
+"""
+
+import json
+import time
+import sqlite3
+
+# Fields a share is compared on, other fields are stored but changes to
+# them aren't reported
+TRACKED_FIELDS = ('stime', 'permissions', 'expiration', 'token')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    fetched REAL NOT NULL,
+    shares INTEGER NOT NULL DEFAULT 0,
+    added INTEGER NOT NULL DEFAULT 0,
+    removed INTEGER NOT NULL DEFAULT 0,
+    changed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS shares (
+    source TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    stime INTEGER,
+    permissions INTEGER,
+    expiration TEXT,
+    token TEXT,
+    fields TEXT NOT NULL,
+    fetched REAL NOT NULL,
+    snapshot INTEGER NOT NULL,
+    PRIMARY KEY (source, id)
+);
+CREATE INDEX IF NOT EXISTS shares_snapshot ON shares (source, snapshot);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    snapshot INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    share_id INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    changes TEXT,
+    fields TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_snapshot ON events (snapshot);
+"""
+
+
+def source_name(ocshareapi):
+    """Name the account a client lists, eg bob@https://example.com/owncloud"""
+    return '%s@%s' % (ocshareapi.username, ocshareapi.url)
+
+
+class SnapshotStore:
+    """SQLite store of the latest listing of each source, and its changes
+
+    Each save() streams a listing into the store, comparing every share
+    with its stored row by id as it goes, so two listings are never held
+    in memory. Shares are compared on TRACKED_FIELDS, and the differences
+    are recorded as added, removed and changed events of the snapshot.
+
+    Keyword arguments:
+        path -- The database file, created if needed
+        batch_size -- Shares compared and written per query
+    """
+
+    def __init__(self, path, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def save(self, records, source=''):
+        """Store a listing, recording how it differs from the last one
+
+        Keyword arguments:
+            records -- Iterable of share dicts, eg
+                       OCShareAPI.iter_share_data(), or of OCShares
+            source -- Name of the account listed, see source_name()
+
+        Returns the id of the new snapshot. If reading records fails,
+        nothing is stored.
+        """
+        fetched = time.time()
+        with self.db:
+            snapshot = self.db.execute(
+                'INSERT INTO snapshots (source, fetched) VALUES (?, ?)',
+                (source, fetched)
+            ).lastrowid
+            counts = {'shares': 0, 'added': 0, 'changed': 0}
+            batch = []
+            for record in records:
+                if not isinstance(record, dict):
+                    record = record.to_dict()
+                    del record['url']
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    self._save(batch, source, fetched, snapshot, counts)
+                    batch = []
+            if batch:
+                self._save(batch, source, fetched, snapshot, counts)
+            # Whatever this snapshot didn't touch is gone
+            removed = self.db.execute(
+                "INSERT INTO events "
+                "(snapshot, source, share_id, event, changes, fields) "
+                "SELECT ?, source, id, 'removed', NULL, fields FROM shares "
+                "WHERE source = ? AND snapshot != ?",
+                (snapshot, source, snapshot)
+            ).rowcount
+            self.db.execute(
+                'DELETE FROM shares WHERE source = ? AND snapshot != ?',
+                (source, snapshot)
+            )
+            self.db.execute(
+                'UPDATE snapshots SET shares = ?, added = ?, removed = ?, '
+                'changed = ? WHERE id = ?',
+                (counts['shares'], counts['added'], removed,
+                 counts['changed'], snapshot)
+            )
+        return snapshot
+
+    def _save(self, batch, source, fetched, snapshot, counts):
+        """Compare a batch of records with the store and write it"""
+        ids = [record['id'] for record in batch]
+        stored = dict(
+            (row[0], row[1:]) for row in self.db.execute(
+                'SELECT id, %s FROM shares '
+                'WHERE source = ? AND id IN (%s)' % (
+                    ', '.join(TRACKED_FIELDS), ', '.join('?' * len(ids))
+                ),
+                [source] + ids
+            )
+        )
+        rows = []
+        events = []
+        for record in batch:
+            fields = json.dumps(record, sort_keys=True)
+            tracked = tuple(record.get(name) for name in TRACKED_FIELDS)
+            old = stored.get(record['id'])
+            if old is None:
+                events.append((
+                    snapshot, source, record['id'], 'added', None, fields
+                ))
+                counts['added'] += 1
+            elif old != tracked:
+                changes = dict(
+                    (name, [before, after]) for name, before, after
+                    in zip(TRACKED_FIELDS, old, tracked) if before != after
+                )
+                events.append((
+                    snapshot, source, record['id'], 'changed',
+                    json.dumps(changes, sort_keys=True), fields
+                ))
+                counts['changed'] += 1
+            rows.append(
+                (source, record['id']) + tracked + (fields, fetched, snapshot)
+            )
+        counts['shares'] += len(batch)
+        self.db.executemany(
+            'INSERT OR REPLACE INTO shares '
+            '(source, id, %s, fields, fetched, snapshot) '
+            'VALUES (?, ?, %s, ?, ?, ?)' % (
+                ', '.join(TRACKED_FIELDS),
+                ', '.join('?' * len(TRACKED_FIELDS))
+            ),
+            rows
+        )
+        self.db.executemany(
+            'INSERT INTO events '
+            '(snapshot, source, share_id, event, changes, fields) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            events
+        )
+
+    def snapshots(self, source=None):
+        """Return the snapshots taken, oldest first, as dicts"""
+        query = (
+            'SELECT id, source, fetched, shares, added, removed, changed '
+            'FROM snapshots'
+        )
+        params = ()
+        if source is not None:
+            query += ' WHERE source = ?'
+            params = (source,)
+        cursor = self.db.execute(query + ' ORDER BY id', params)
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def shares(self, source=''):
+        """Iterate over the stored share dicts of a source"""
+        for row in self.db.execute(
+                'SELECT fields FROM shares WHERE source = ? ORDER BY id',
+                (source,)):
+            yield json.loads(row[0])
+
+    def events(self, since=None, snapshot=None, source=None):
+        """Iterate over recorded events, oldest first
+
+        Keyword arguments:
+            since -- Only events of snapshots after this snapshot id
+            snapshot -- Only the events of this snapshot id
+            source -- Only events of this source
+
+        Events are dicts with the snapshot id, its fetched time, source,
+        share_id, event ('added', 'removed' or 'changed'), changes (a
+        dict of field to [old, new] for changed shares, else None) and
+        share (the share's fields, as last seen).
+        """
+        query = (
+            'SELECT events.snapshot, snapshots.fetched, events.source, '
+            'events.share_id, events.event, events.changes, events.fields '
+            'FROM events JOIN snapshots ON snapshots.id = events.snapshot'
+        )
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append('events.snapshot > ?')
+            params.append(since)
+        if snapshot is not None:
+            conditions.append('events.snapshot = ?')
+            params.append(snapshot)
+        if source is not None:
+            conditions.append('events.source = ?')
+            params.append(source)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        for row in self.db.execute(query + ' ORDER BY events.id', params):
+            yield {
+                'snapshot': row[0],
+                'fetched': row[1],
+                'source': row[2],
+                'share_id': row[3],
+                'event': row[4],
+                'changes': json.loads(row[5]) if row[5] else None,
+                'share': json.loads(row[6])
+            }
@@ -7,6 +7,10 @@ description='Easy tool to access ownCloud shares',
 author='Azelphur',
 author_email='support@azelphur.com',
 url='https://github.com/Azelphur/owncloud-share-tools',
-py_modules=['ocsharetools', 'ocsharetools_gui', 'ocsharetools_cli'],
-entry_points = {'gui_scripts': ['ocsharetools = ocsharetools_cli:run']},
-install_requires=['requests'])
+py_modules=['ocsharetools', 'ocsharetools_async', 'ocsharetools_gui',
+            'ocsharetools_cli', 'ocsharetools_daemon',
+            'ocsharetools_snapshot'],
+entry_points = {'gui_scripts': ['ocsharetools = ocsharetools_cli:run',
+                                'ocsharetools-daemon = ocsharetools_daemon:run']},
+install_requires=['requests'],
+extras_require={'async': ['aiohttp']})
@@ -0,0 +1,47 @@
+import os
+import sys
+import asyncio
+import unittest
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from mock_server import MockServer
+from ocsharetools import OCShare, SHARETYPE_PUBLIC
+from ocsharetools_async import AsyncOCShareAPI
+
+
+class CreateSharesTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer(shares=0).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_malformed_spec_fails_alone(self):
+        async def create():
+            async with AsyncOCShareAPI(
+                    self.server.url, 'user', 'secret') as ocs:
+                return await ocs.create_shares([
+                    {'path': '/a', 'share_type': SHARETYPE_PUBLIC},
+                    {'path': '/b', 'share_typo': SHARETYPE_PUBLIC},
+                    {'path': '/c', 'share_type': SHARETYPE_PUBLIC},
+                ])
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            results = asyncio.run(create())
+        self.assertIsInstance(results[0], OCShare)
+        self.assertIsInstance(results[1], TypeError)
+        self.assertIsInstance(results[2], OCShare)
+        self.assertEqual(
+            [str(w.message) for w in caught
+             if 'never awaited' in str(w.message)],
+            []
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
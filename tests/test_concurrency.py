@@ -0,0 +1,40 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from mock_server import MockServer
+from ocsharetools import ConcurrencyController, OCShareAPI
+
+
+class SendReleaseTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer(shares=3).start()
+        self.controller = ConcurrencyController(initial=1, maximum=1)
+        self.ocs = OCShareAPI(
+            self.server.url, 'user', 'secret', controller=self.controller
+        )
+
+    def tearDown(self):
+        self.ocs.close()
+        self.server.stop()
+
+    def test_other_request_errors_release_their_slot(self):
+        with mock.patch.object(
+                requests.Session, 'request',
+                side_effect=requests.exceptions.ChunkedEncodingError()):
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                self.ocs.get_share_by_id(1)
+        self.assertEqual(self.controller.in_flight, 0)
+        # Would block forever on a leaked slot
+        self.assertEqual(self.ocs.get_share_by_id(2).id, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()